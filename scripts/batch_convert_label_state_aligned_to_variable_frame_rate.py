@@ -6,13 +6,16 @@
 DESCRIPTION:
 As Merlin works at a constant frame rate and this vocoder runs at a variable frame rate, it is needed to trick Merlin by warping the time durations in the label files.
 This script converts the original label files to the "variable rate frame" labels, thus compensating the variable-to-constant frame rate difference.
+It runs the conversion in parallel mode, using all the cores available in the system (see lu.run_batch).
+In incremental mode, the output label files that are newer than their inputs (.lab and .shift) are skipped.
 
 INSTRUCTIONS:
 This demo should work out of the box. Just run it by typing: python <script name>
 If you want to use this demo with real data to work with Merlin, just modify the directories, input files, accordingly.
 See the main function below for details.
 
-NOTE: The file crashlist_file will store the list of utterances that were not possible to convert.
+NOTE: The file crashlist_file will store the list of utterances that were not possible to convert, and error_report_file
+the error of each one (JSON format, see lu.write_batch_error_report).
 This could happen if for example some phonemes had no frames assigned. This rarelly occurs.
 """
 
@@ -21,12 +24,18 @@ this_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.realpath(this_dir + '/../src'))
 
 import libutils as lu
-import libaudio as la
 import magphase as mp
 
 
-if __name__ == '__main__':  
-    
+def convert_label(ftkn, in_lab_st_dir, in_shift_dir, out_lab_st_dir, fs, b_prevent_zeros):
+    in_lab_st_file  = in_lab_st_dir  + '/' + ftkn + '.lab'
+    in_shift_file   = in_shift_dir   + '/' + ftkn + '.shift'
+    out_lab_st_file = out_lab_st_dir + '/' + ftkn + '.lab'
+    return mp.convert_label_state_align_to_var_frame_rate(in_lab_st_file, in_shift_file, out_lab_st_file, fs, b_prevent_zeros=b_prevent_zeros,
+                                                          n_states_x_phone=5, nfrms_tolerance=6)
+
+if __name__ == '__main__':
+
     # CONSTANTS: So far, the vocoder has been tested only with the following constants:===
     fs = 48000
 
@@ -39,35 +48,34 @@ if __name__ == '__main__':
     b_prevent_zeros = False                             # True if you want to make sure that all the phonemes have one frame at least.
                                                         # (not recommended, only usful when there are too many utterances crashed)
 
+    b_multiproc     = True   # If True, it converts using all the available cores in parallel. If False, it just uses one core.
+    b_incremental   = True   # If True, output files newer than their inputs (.lab and .shift) are not converted again.
+    crashlist_file     = lu.ins_pid('crash_file_list.scp')
+    error_report_file  = lu.ins_pid('crash_report.json')
+
 
     # PROCESSING:=========================================================================
     lu.mkdir(out_lab_st_dir)
-    v_fileTokns = lu.read_text_file2(files_scp, dtype='string', comments='#')
-    n_files = len(v_fileTokns)
-    
-    crashlist_file = lu.ins_pid('crash_file_list.scp')
-    for ftkn in v_fileTokns:
-        
-        # Display:
-        print('\nAnalysing file: ' + ftkn + '................................')
-        
-        # Input files:
-        in_lab_st_file  = in_lab_st_dir  + '/' + ftkn + '.lab'
-        out_lab_st_file = out_lab_st_dir + '/' + ftkn + '.lab'
-        in_shift_file   = in_shift_dir   + '/' + ftkn + '.shift'
-
-        try:
-            v_shift  = lu.read_binfile(in_shift_file, dim=1)
-            v_n_frms = mp.get_num_of_frms_per_state(v_shift, in_lab_st_file, fs, b_prevent_zeros=b_prevent_zeros, n_states_x_phone=5, nfrms_tolerance=6)
-
-            # Extraction:
-            la.convert_label_state_align_to_var_frame_rate(in_lab_st_file, v_n_frms, out_lab_st_file)
-        
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            with open(crashlist_file, "a") as crashlistlog:
-                crashlistlog.write(ftkn + '\n')
-
-    print('Done!')
-        
+    l_file_tokns = lu.read_text_file2(files_scp, dtype='string', comments='#').tolist()
+
+    if b_incremental:
+        n_files = len(l_file_tokns)
+        l_file_tokns = [ ftkn for ftkn in l_file_tokns if not lu.is_up_to_date(out_lab_st_dir + '/' + ftkn + '.lab',
+                                                        [in_lab_st_dir + '/' + ftkn + '.lab', in_shift_dir + '/' + ftkn + '.shift']) ]
+        print('Skipping %d up to date file(s).' % (n_files - len(l_file_tokns)))
+
+    nprocs = None if b_multiproc else 1
+    d_results, d_errors = lu.run_batch(convert_label, l_file_tokns, args=(in_lab_st_dir, in_shift_dir, out_lab_st_dir, fs, b_prevent_zeros),
+                                        nprocs=nprocs, n_retries=0, b_verbose=False)
+
+    # Errors report:
+    if len(d_errors) > 0:
+        with open(crashlist_file, "a") as crashlistlog:
+            crashlistlog.write(''.join([ ftkn + '\n' for ftkn in d_errors.keys() ]))
+        lu.write_batch_error_report(d_errors, error_report_file)
+
+        print('Failed files (%d), see: %s' % (len(d_errors), error_report_file))
+        for ftkn in d_errors.keys():
+            print('%s: %s: %s' % ((ftkn,) + lu.get_batch_error_info(d_errors[ftkn])))
+
+    print('Done! %d file(s) converted.' % len(d_results))
@@ -5,7 +5,8 @@
 
 DESCRIPTION:
 This script extracts low-dimensional acoustic features from a batch of wav files intended for using with the Merlin toolkit.
-It runs the extraction in parallel mode, using all the cores available in the system.
+It runs the extraction in parallel mode, using all the cores available in the system (see lu.run_batch).
+If interrupted, running it again resumes the batch (completed files are listed in the manifest file).
 
 The acoustic features extracted and used by Merlin are:
 - '<file>.mag'  : Mel-scaled Log-Mag (dim=nbins_mel,   usually 60).
@@ -13,6 +14,8 @@ The acoustic features extracted and used by Merlin are:
 - '<file>.imag' : Mel-scaled imag    (dim=nbins_phase, usually 45).
 - '<file>.lf0'  : Log-F0 (dim=1).
 
+Alternatively, all the features can be stored in a single feature store file (see store_file below, and lu.FeatStore).
+
 Also, this script extracts the additional files:
 - '<file>.est'  : File generated by REAPER containing epoch locations and voi/unvoi decisions (remove them if wanted).
 - '<file>.shift': File that contains the shifts (hop-sizes) for each extracted frame (variable frame rate).
@@ -28,9 +31,10 @@ curr_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.realpath(curr_dir + '/../src'))
 import libutils as lu
 import magphase as mp
+import soundfile as sf
 
 
-def feat_extraction(in_wav_dir, file_name_token, out_feats_dir):
+def feat_extraction(file_name_token, in_wav_dir, out_feats_dir):
 
     # Display:
     print("\nAnalysing file: " + file_name_token + '.wav............................')
@@ -40,6 +44,14 @@ def feat_extraction(in_wav_dir, file_name_token, out_feats_dir):
     mp.analysis_for_acoustic_modelling(wav_file, out_feats_dir)
     return
 
+def feat_extraction_for_store(file_name_token, in_wav_dir):
+    '''
+    Returns the features instead of writing them, so they are written into the feature store by the main process.
+    '''
+    print("\nAnalysing file: " + file_name_token + '.wav............................')
+    wav_file = os.path.join(in_wav_dir, file_name_token + '.wav')
+    return mp.analysis_compressed(wav_file)
+
 if __name__ == '__main__':  
     
     # INPUT:==============================================================================
@@ -48,16 +60,47 @@ if __name__ == '__main__':
     out_feats_dir = '../demos/data_48k/params_nat'  # Output directory that will contain the extracted features.
 
     b_multiproc   = True
+    nprocs        = None  # Number of parallel processes. If None, all the available cores.
+    b_threads     = False # If True, workers are threads of a single process (shared caches, less memory). Needs the "pyfftw" FFT backend (config.ini) to scale.
+                          # Use it with a multithreaded FFT backend (see [FFT] in config.ini, or la.set_fft_backend).
+    n_retries     = 1     # Number of times a failed file is retried.
+    manifest_file = os.path.join(out_feats_dir, 'completed.scp') # Completed files (to resume an interrupted batch). None to disable it.
+    store_file    = None  # If not None (e.g., os.path.join(out_feats_dir, 'feats.store')), all the features are stored in this single file.
+                          # Use mp.export_store_to_featfiles to get the per-file features from it.
+
     # FILES SETUP:========================================================================
     lu.mkdir(out_feats_dir)
     l_file_tokns = lu.read_text_file2(files_scp, dtype='string', comments='#').tolist()
+    l_wav_files  = [ os.path.join(in_wav_dir, file_name_token + '.wav') for file_name_token in l_file_tokns ]
 
     # MULTIPROCESSING EXTRACTION:==========================================================
-    if b_multiproc:
-        lu.run_multithreaded(feat_extraction, in_wav_dir, l_file_tokns, out_feats_dir)
+    # Longest files first. Each worker precomputes the Mel warping matrices once (warm up).
+    if not b_multiproc:
+        nprocs = 1
+
+    fs = sf.info(l_wav_files[0]).samplerate
+    l_sizes = [ os.path.getsize(wav_file) for wav_file in l_wav_files ]
+    if store_file is None:
+        d_results, d_errors = lu.run_batch(feat_extraction, l_file_tokns, args=(in_wav_dir, out_feats_dir), nprocs=nprocs, l_sizes=l_sizes,
+                                            init_func=mp.warm_up, init_args=(fs, 60, 10), n_retries=n_retries, manifest_file=manifest_file,
+                                            b_threads=b_threads)
     else:
-        for file_name_token in l_file_tokns:
-            feat_extraction(in_wav_dir, file_name_token, out_feats_dir)
+        # Features are written by this process as they arrive. Files already in the store are skipped.
+        store = lu.FeatStore(store_file, mode='a')
+        def write_to_store(file_name_token, t_feats):
+            m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, v_shift, fs, fft_len = t_feats
+            mp.write_feats_to_store(store, file_name_token, m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs, fft_len, v_shift=v_shift)
+            return None
+
+        v_nx_todo = [ nx for nx in xrange(len(l_file_tokns)) if l_file_tokns[nx] not in store ]
+        d_results, d_errors = lu.run_batch(feat_extraction_for_store, [ l_file_tokns[nx] for nx in v_nx_todo ], args=(in_wav_dir,),
+                                            nprocs=nprocs, l_sizes=[ l_sizes[nx] for nx in v_nx_todo ],
+                                            init_func=mp.warm_up, init_args=(fs, 60, 10), n_retries=n_retries, result_func=write_to_store,
+                                            b_threads=b_threads)
+        store.close()
+
+    if len(d_errors) > 0:
+        print('Failed files: ' + ', '.join(d_errors.keys()))
 
     print('Done!')
         
@@ -11,23 +11,33 @@ This script synthesises waveforms from the MagPhase parameters predicted by Merl
 - *.lf0:  Log-F0 (dim=1).
 
 NOTE: Actually, it can be used to synthesise waveforms from any MagPhase parameters (no Merlin required).
+NOTE: If n_files_x_batch > 1, each worker synthesises groups of files at once (see mp.synthesis_from_acoustic_modelling_batch).
 
 INSTRUCTIONS:
 This demo should work out of the box. Just run it by typing: python <script name>
 If you want to use this demo with real data to work with Merlin, just modify the directories, input files, accordingly.
 See the main function below for details.
 """
-import sys, os
+import sys, os, time
 curr_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.realpath(curr_dir + '/../src'))
 import libutils as lu
 from libplot import lp
+import numpy as np
 import magphase as mp
 
-def synthesis(in_feats_dir, filename_token, out_syn_dir, mag_dim, phase_dim, fs, pf_type):
+def synthesis(filename_token, in_feats_dir, out_syn_dir, mag_dim, phase_dim, fs, pf_type):
     mp.synthesis_from_acoustic_modelling(in_feats_dir, filename_token, out_syn_dir, mag_dim, phase_dim, fs, pf_type=pf_type, b_const_rate=False)
     return
 
+def synthesis_batch(filename_tokens, in_feats_dir, out_syn_dir, mag_dim, phase_dim, fs, pf_type):
+    '''
+    filename_tokens: Comma separated file names (tokens).
+    '''
+    mp.synthesis_from_acoustic_modelling_batch(in_feats_dir, filename_tokens.split(','), out_syn_dir, mag_dim, phase_dim, fs,
+                                                                                        pf_type=pf_type, b_const_rate=False)
+    return
+
 if __name__ == '__main__':  
 
     # CONSTANTS:
@@ -37,6 +47,7 @@ if __name__ == '__main__':
 
     files_scp     = '../demos/data_48k/file_id_predict.scp'     # List of file names (tokens). Format used by Merlin.
     in_feats_dir  = '../demos/data_48k/params_predicted'          # Input directory that contains the predicted features.
+    in_feats_store = None # If not None, the features are read from this feature store file instead (see mp.import_featfiles_to_store).
     out_syn_dir   = '../demos/data_48k/wavs_syn_from_predicted' # Where the synthesised waveform will be stored.
 
 
@@ -47,19 +58,44 @@ if __name__ == '__main__':
                              # "no":       No postfilter.
 
     b_multiproc   = False    # If True, it synthesises using all the available cores in parallel. If False, it just uses one core (slower).
+    n_files_x_batch = 1      # Number of files synthesised at once by each worker (e.g., 8 for many short utterances).
+    b_threads     = False    # If True (and b_multiproc), workers are threads of a single process (shared caches, less memory). Needs the "pyfftw" FFT backend (config.ini) to scale.
+                             # Use it with a multithreaded FFT backend (see [FFT] in config.ini, or la.set_fft_backend).
+    n_retries     = 1        # Number of times a failed file is retried.
+    manifest_file = None     # Text file to store the completed files, to resume an interrupted batch (e.g., out_syn_dir + '/completed.scp').
 
 
     # FILES SETUP:========================================================================
     lu.mkdir(out_syn_dir)
     l_file_tokns = lu.read_text_file2(files_scp, dtype='string', comments='#').tolist()
+    if in_feats_store is not None:
+        in_feats_dir = lu.FeatStore(in_feats_store) # Read only (it is reopened by each worker).
 
     # PROCESSING:=========================================================================
-    if b_multiproc:
-        lu.run_multithreaded(synthesis, in_feats_dir, l_file_tokns, out_syn_dir, mag_dim, phase_dim, fs, pf_type)
+    # Longest files first. Each worker precomputes the Mel unwarping matrices once (warm up).
+    nprocs = None if b_multiproc else 1
+    if in_feats_store is None:
+        l_sizes = [ os.path.getsize(os.path.join(in_feats_dir, file_tokn + '.lf0')) for file_tokn in l_file_tokns ]
     else:
-        for file_tokn in l_file_tokns:
-            synthesis(in_feats_dir, file_tokn, out_syn_dir, mag_dim, phase_dim, fs, pf_type)
-
+        l_sizes = [ in_feats_dir.get_attrs(file_tokn)['nfrms'] for file_tokn in l_file_tokns ]
+    func = synthesis
+    if n_files_x_batch > 1: # Groups of files (longest first), as comma separated tokens:
+        l_file_tokns = [ l_file_tokns[nx] for nx in np.argsort(-np.array(l_sizes), kind='mergesort') ]
+        l_file_tokns = [ ','.join(l_file_tokns[nx:(nx+n_files_x_batch)]) for nx in xrange(0, len(l_file_tokns), n_files_x_batch) ]
+        l_sizes      = None
+        func         = synthesis_batch
+
+    t_strt = time.time()
+    d_results, d_errors = lu.run_batch(func, l_file_tokns, args=(in_feats_dir, out_syn_dir, mag_dim, phase_dim, fs, pf_type),
+                                        nprocs=nprocs, l_sizes=l_sizes, init_func=mp.warm_up, init_args=(fs, mag_dim, phase_dim),
+                                        n_retries=n_retries, manifest_file=manifest_file, b_threads=b_threads)
+    t_elapsed = time.time() - t_strt
+
+    if len(d_errors) > 0:
+        print('Failed files: ' + ', '.join(d_errors.keys()))
+
+    nfiles = sum([ len(tokns.split(',')) for tokns in d_results.keys() ])
+    print('%d file(s) synthesised in %.1f s (%.2f files/s).' % (nfiles, t_elapsed, nfiles / t_elapsed if t_elapsed > 0 else 0.0))
 
     print('Done!')
 
@@ -12,8 +12,16 @@ import numpy as np
 import os
 import glob
 import time
-from multiprocessing import Pool
+import sys
+import traceback
+import warnings
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+import threading
 import socket
+import json
+import struct
+from collections import OrderedDict
 
 #==============================================================================
 # FUNCTIONS
@@ -60,8 +68,204 @@ def run_multithreaded(*args):
     # Run multiprocess:
     pool    = Pool()
     results = pool.map(func_wrapper, l_iterable_args)
+    pool.close()
+    pool.join()
     return results
 
+# Batch processing engine:-------------------------------------------------------------------
+# State of each worker process (set once per worker by _batch_worker_init):
+_batch_worker = {}
+
+def _batch_worker_init(func, args, kargs, init_func, init_args):
+    '''
+    Helper function used by "run_batch". Runs once per worker process.
+    '''
+    _batch_worker['func']  = func
+    _batch_worker['args']  = args
+    _batch_worker['kargs'] = kargs
+    if init_func is not None:
+        init_func(*init_args)
+    return
+
+def _batch_worker_run(item):
+    '''
+    Helper function used by "run_batch". Errors are captured (and returned) per item.
+    '''
+    t_strt = time.time()
+    try:
+        result = _batch_worker['func'](item, *_batch_worker['args'], **_batch_worker['kargs'])
+        return item, True, result, time.time() - t_strt
+    except Exception:
+        return item, False, traceback.format_exc(), time.time() - t_strt
+
+def read_batch_manifest(manifest_file):
+    '''
+    Returns the set of completed item IDs stored in a run_batch manifest file (empty if the file does not exist).
+    '''
+    if not os.path.isfile(manifest_file):
+        return set()
+    with open(manifest_file) as fid:
+        return set([line.strip() for line in fid if line.strip()])
+
+def run_batch(func, l_items, args=(), kargs=None, nprocs=None, l_sizes=None, init_func=None, init_args=(),
+                                                        n_retries=1, manifest_file=None, result_func=None, b_threads=False, b_verbose=True):
+    '''
+    Batch processing engine (e.g., for feature extraction or waveform generation over many files).
+    Each item is processed by calling func(item, *args, **kargs). func must be defined at module level (picklable).
+
+    nprocs:        Number of worker processes (or threads, see b_threads). If None, all the available cores. If 1, it runs in the current process.
+                   Workers are persistent for the whole batch, and func, args and kargs are sent once per worker.
+    l_sizes:       Optional. Size (e.g., file size or duration) of each item. Largest items are processed first (better load balance).
+    init_func:     Optional. Called once per worker as init_func(*init_args) before any item (e.g., to warm up caches).
+    n_retries:     Number of times failed items are retried (at the end). Errors do not stop the batch.
+    manifest_file: Optional. Text file with the IDs (str(item)) of the completed items, one per line. Items already in it are skipped
+                   (i.e., resume an interrupted batch), and each item is added as soon as it is completed.
+    result_func:   Optional. Called in the current (parent) process as result_func(item, result) as soon as each item is completed
+                   (e.g., to write the results of all the workers into a single lu.FeatStore). If given, d_results keeps its
+                   return value instead of the result of func (e.g., return None to not keep large results in memory).
+    b_threads:     If True, workers are threads of the current process instead of processes. Caches (e.g., transform matrices)
+                   are shared, init_func is called only once, and memory does not grow per worker. Useful with the
+                   "pyfftw" FFT backend or GIL-free numerical code (see la.set_fft_backend). With the "numpy" backend
+                   a warning is issued, since numpy.fft holds the GIL.
+    b_verbose:     If True, progress and throughput are printed.
+
+    Returns d_results (ID: result of func), and d_errors (ID: traceback of the last failure).
+    '''
+    if kargs is None:
+        kargs = {}
+
+    # Items to process:
+    l_items = list(l_items)
+    if l_sizes is not None:
+        v_order = np.argsort(-np.array(l_sizes, dtype='float64'), kind='mergesort') # stable, largest first
+        l_items = [ l_items[nx] for nx in v_order ]
+
+    if manifest_file is not None:
+        set_done = read_batch_manifest(manifest_file)
+        n_skip   = len(l_items)
+        l_items  = [ item for item in l_items if str(item) not in set_done ]
+        n_skip  -= len(l_items)
+        if b_verbose and (n_skip > 0):
+            print('Skipping %d item(s) already completed according to the manifest file: %s' % (n_skip, manifest_file))
+
+    nitems    = len(l_items)
+    d_results = OrderedDict()
+    d_errors  = OrderedDict()
+    if nitems==0:
+        return d_results, d_errors
+
+    # Workers:
+    if nprocs is None:
+        nprocs = cpu_count()
+    nprocs = min(nprocs, nitems)
+
+    if (nprocs > 1) and b_threads:
+        # numpy.fft holds the GIL, so threads would mostly wait for each other (libaudio imports this module, not the opposite):
+        if ('libaudio' in sys.modules) and (sys.modules['libaudio'].get_fft_backend()[0]=='numpy'):
+            warnings.warn('run_batch: b_threads=True with the "numpy" FFT backend (it holds the GIL). Little or no speedup '
+                          'is expected. Use processes (b_threads=False), or the "pyfftw" backend (see la.set_fft_backend).')
+        _batch_worker_init(func, args, kargs, init_func, init_args)
+        pool = ThreadPool(processes=nprocs)
+        f_map = lambda l_curr_items: pool.imap_unordered(_batch_worker_run, l_curr_items, chunksize=1)
+    elif nprocs > 1:
+        pool = Pool(processes=nprocs, initializer=_batch_worker_init, initargs=(func, args, kargs, init_func, init_args))
+        f_map = lambda l_curr_items: pool.imap_unordered(_batch_worker_run, l_curr_items, chunksize=1)
+    else:
+        pool = None
+        _batch_worker_init(func, args, kargs, init_func, init_args)
+        f_map = lambda l_curr_items: (_batch_worker_run(item) for item in l_curr_items)
+
+    fid_manifest = open(manifest_file, 'a') if (manifest_file is not None) else None
+    t_strt = time.time()
+    ndone  = 0
+    try:
+        l_pending = l_items
+        for nx_round in xrange(n_retries + 1):
+            if len(l_pending)==0:
+                break
+            if b_verbose and (nx_round > 0):
+                print('Retrying %d failed item(s) (retry %d of %d)...' % (len(l_pending), nx_round, n_retries))
+
+            l_failed = []
+            for item, b_ok, result, t_item in f_map(l_pending):
+                item_id = str(item)
+                if b_ok:
+                    ndone += 1
+                    if result_func is not None:
+                        result = result_func(item, result)
+                    d_results[item_id] = result
+                    d_errors.pop(item_id, None)
+                    if fid_manifest is not None:
+                        fid_manifest.write(item_id + '\n')
+                        fid_manifest.flush()
+                else:
+                    l_failed.append(item)
+                    d_errors[item_id] = result
+
+                if b_verbose:
+                    t_elapsed = time.time() - t_strt
+                    thrput    = ndone / t_elapsed if t_elapsed > 0 else 0.0
+                    eta       = (nitems - ndone) / thrput if thrput > 0 else float('nan')
+                    status    = 'ok' if b_ok else 'FAILED'
+                    sys.stdout.write('[%d/%d] %s: %s (%.1f s) | %.2f items/s, elapsed: %.0f s, ETA: %.0f s\n'
+                                                    % (ndone, nitems, item_id, status, t_item, thrput, t_elapsed, eta))
+                    if not b_ok:
+                        sys.stdout.write(result)
+                    sys.stdout.flush()
+
+            l_pending = l_failed
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    except:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+
+    finally:
+        if fid_manifest is not None:
+            fid_manifest.close()
+
+    if b_verbose:
+        print('Batch finished: %d of %d item(s) completed, %d failed, in %.1f s.' % (ndone, nitems, len(d_errors), time.time() - t_strt))
+
+    return d_results, d_errors
+
+def get_batch_error_info(error_traceback):
+    '''
+    Returns the error type and message (e.g., 'ValueError', 'wrong value') from a traceback returned by run_batch (in d_errors).
+    '''
+    l_lines = [ line for line in error_traceback.strip().splitlines() if line.strip() ]
+    if len(l_lines)==0:
+        return '', ''
+    error_type, _, message = l_lines[-1].partition(':')
+    return error_type.strip(), message.strip()
+
+def write_batch_error_report(d_errors, report_file):
+    '''
+    Writes the errors of run_batch (d_errors) to a JSON file (structured per item): {ID: {'type':, 'message':, 'traceback':}}
+    '''
+    d_report = OrderedDict()
+    for item_id, error_traceback in d_errors.items():
+        error_type, message = get_batch_error_info(error_traceback)
+        d_report[item_id] = OrderedDict([('type', error_type), ('message', message), ('traceback', error_traceback)])
+
+    with open(report_file, 'w') as fid:
+        json.dump(d_report, fid, indent=2)
+    return
+
+def is_up_to_date(out_file, l_in_files):
+    '''
+    True if out_file exists and it is not older than any of the input files (e.g., to skip it in incremental batch processing).
+    '''
+    if not os.path.isfile(out_file):
+        return False
+    out_mtime = os.path.getmtime(out_file)
+    return all(os.path.isfile(in_file) and (os.path.getmtime(in_file) <= out_mtime) for in_file in l_in_files) # missing inputs: not up to date
+
 #---------------------------------------------------------------------------------
 
 def gen_list_of_file_paths(files_dir, v_file_tkns, suffix):
@@ -109,19 +313,34 @@ def get_file_list(files_path):
     return files_list, n_files
 
 
-def read_binfile(filename, dim=60):
-    fid = open(filename, 'rb')
-    v_data = np.fromfile(fid, dtype=np.float32)
-    fid.close()
+def read_binfile(filename, dim=60, dtype='float64', b_mmap=False):
+    '''
+    Reads a float32 binary file (e.g., Merlin features).
+    dtype:  Output data type. 'float64' by default, to keep compatibility with numpy default dtype.
+            Data is stored as float32, so dtype='float32' avoids the conversion (copy).
+    b_mmap: If True, the file is memory-mapped (read-only) instead of read into memory.
+            With dtype='float32', it returns a view of the file (np.memmap), with no copy at all.
+    '''
+    if b_mmap and (os.path.getsize(filename) > 0):
+        v_data = np.memmap(filename, dtype=np.float32, mode='r')
+    else:
+        fid = open(filename, 'rb')
+        v_data = np.fromfile(fid, dtype=np.float32)
+        fid.close()
     if np.mod(v_data.size, dim) != 0:
         raise ValueError('Dimension provided not compatible with file size.')
-    m_data = v_data.reshape((-1, dim)).astype('float64') # This is to keep compatibility with numpy default dtype.
+    m_data = v_data.reshape((-1, dim))
+    if m_data.dtype != np.dtype(dtype):
+        m_data = m_data.astype(dtype)
     m_data = np.squeeze(m_data)
     return  m_data
 
-def write_binfile(m_data, filename):
-    m_data = np.array(m_data, 'float32') # Ensuring float32 output
-    fid = open(filename, 'wb')
+def write_binfile(m_data, filename, b_append=False):
+    '''
+    b_append: If True, data is added at the end of the file (e.g., to write features block by block).
+    '''
+    m_data = np.asarray(m_data, 'float32') # Ensuring float32 output (no copy if it is already float32)
+    fid = open(filename, 'ab' if b_append else 'wb')
     m_data.tofile(fid)
     fid.close()
     return
@@ -176,6 +395,263 @@ class DimProtect(object):
                 data.resize((data.shape[0],))
         return
 
+# Least recently used (LRU) cache. Useful to store precomputed matrices, windows, etc.
+# Thread safe (e.g., shared by the workers of run_batch with b_threads=True).
+class LRUCache(object):
+    def __init__(self, maxsize=32):
+        '''
+        maxsize: Maximum number of stored items. If None, no limit.
+        '''
+        self.maxsize = maxsize
+        self.hits    = 0
+        self.misses  = 0
+        self._data   = OrderedDict()
+        self._lock   = threading.RLock()
+        return
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value = self._data.pop(key) # moving it to the end (most recently used)
+                self._data[key] = value
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._data.pop(key)
+            self._data[key] = value
+            self.resize(self.maxsize)
+        return
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            if maxsize is not None:
+                while len(self._data) > maxsize:
+                    self._data.popitem(last=False) # least recently used
+        return
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits   = 0
+            self.misses = 0
+        return
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+# Feature store:-----------------------------------------------------------------------------
+class FeatStore(object):
+    '''
+    Single-file container of float32 feature data (e.g., for a whole corpus), with an index for random access.
+    Each ID (e.g., utterance) stores several named streams (vectors or matrices of frames, e.g., 'mag', 'lf0'),
+    plus a dictionary of attributes (e.g., fs).
+
+    File layout:
+    - Header:  'MPFSTORE', index offset (uint64, 0 if the index is not up to date), index size (uint64).
+    - Records: 'REC0', meta size (uint32), meta (JSON: ID, stream names and shapes, attributes), and data (float32, one
+               contiguous block per stream).
+    - Index:   JSON list with the meta (plus data offset) of the current record of each ID. Written by flush() or close().
+    If the index is not up to date (e.g., the writing process was killed), it is rebuilt from the records when opening.
+    Writing an existing ID again replaces it in the index (its old data remains in the file).
+
+    mode: 'r': Read only. Reads are memory-mapped (no copy). A store in this mode can be passed to other processes (it is reopened).
+          'w': Create (or overwrite).
+          'a': Append (create if it doesn't exist).
+    '''
+    _magic   = b'MPFSTORE'
+    _rec_tag = b'REC0'
+    _hdr_fmt = '<8sQQ'
+    _rec_fmt = '<4sI'
+
+    def __init__(self, filename, mode='r'):
+        if mode not in ('r', 'w', 'a'):
+            raise ValueError("mode must be 'r', 'w', or 'a'.")
+        if (mode=='a') and (not os.path.isfile(filename)):
+            mode = 'w'
+
+        self.filename  = filename
+        self.mode      = mode
+        self._d_index  = OrderedDict()
+        self._mmap     = None
+        self._b_idx_ok = False
+
+        if mode=='w':
+            self._fid = open(filename, 'w+b')
+            self._write_header(0, 0)
+            self._end = self._fid.tell()
+            return
+
+        self._fid = open(filename, 'rb' if mode=='r' else 'r+b')
+        magic, idx_offset, idx_size = struct.unpack(self._hdr_fmt, self._fid.read(struct.calcsize(self._hdr_fmt)))
+        if magic != self._magic:
+            raise IOError('%s is not a feature store file.' % filename)
+
+        if idx_offset > 0:
+            self._fid.seek(idx_offset)
+            for d_meta in json.loads(self._fid.read(idx_size).decode('utf-8')):
+                self._d_index[str(d_meta['id'])] = d_meta
+            self._end      = idx_offset
+            self._b_idx_ok = True
+        else:
+            self._rebuild_index()
+        return
+
+    def _write_header(self, idx_offset, idx_size):
+        self._fid.seek(0)
+        self._fid.write(struct.pack(self._hdr_fmt, self._magic, idx_offset, idx_size))
+        self._fid.flush()
+        return
+
+    def _rebuild_index(self):
+        '''
+        Scans the records. Incomplete records at the end (if any) are discarded.
+        '''
+        file_size = os.fstat(self._fid.fileno()).st_size
+        rec_size  = struct.calcsize(self._rec_fmt)
+        pos       = struct.calcsize(self._hdr_fmt)
+        while pos + rec_size <= file_size:
+            self._fid.seek(pos)
+            tag, meta_size = struct.unpack(self._rec_fmt, self._fid.read(rec_size))
+            if (tag != self._rec_tag) or (pos + rec_size + meta_size > file_size):
+                break
+            d_meta = json.loads(self._fid.read(meta_size).decode('utf-8'))
+            d_meta['offset'] = pos + rec_size + meta_size
+            if d_meta['offset'] + d_meta['nbytes'] > file_size:
+                break
+            self._d_index[str(d_meta['id'])] = d_meta
+            pos = d_meta['offset'] + d_meta['nbytes']
+
+        self._end = pos
+        return
+
+    def put(self, data_id, l_streams, d_attrs=None):
+        '''
+        l_streams: List of (name, data) pairs. data: vector or matrix (frames x dim). Stored as float32.
+        d_attrs:   Optional. Dictionary of attributes (JSON serialisable).
+        '''
+        if self.mode=='r':
+            raise IOError('Feature store opened in read only mode.')
+
+        l_data = [ np.ascontiguousarray(data, dtype='float32') for name, data in l_streams ]
+        d_meta = { 'id'     : str(data_id),
+                   'streams': [ [name, list(m_data.shape)] for (name, data), m_data in zip(l_streams, l_data) ],
+                   'attrs'  : {} if d_attrs is None else dict(d_attrs),
+                   'nbytes' : sum([ m_data.nbytes for m_data in l_data ]) }
+        meta  = json.dumps(d_meta).encode('utf-8')
+        meta += b' ' * (-len(meta) % 4) # keeps the data 4-byte aligned.
+
+        # The index at the end of the file (if any) is overwritten:
+        if self._b_idx_ok:
+            self._write_header(0, 0)
+            self._b_idx_ok = False
+
+        self._fid.seek(self._end)
+        self._fid.write(struct.pack(self._rec_fmt, self._rec_tag, len(meta)))
+        self._fid.write(meta)
+        d_meta['offset'] = self._fid.tell()
+        for m_data in l_data:
+            self._fid.write(m_data.tostring())
+        self._end = self._fid.tell()
+        self._d_index[d_meta['id']] = d_meta
+        return
+
+    def get(self, data_id, stream):
+        '''
+        Returns the data of a stream (float32). In 'r' mode, it is a read-only view of the memory-mapped file.
+        '''
+        d_meta = self._d_index[str(data_id)]
+        offset = d_meta['offset']
+        for name, shape in d_meta['streams']:
+            nbytes = 4 * int(np.prod(shape))
+            if name==stream:
+                break
+            offset += nbytes
+        else:
+            raise KeyError("Stream '%s' not found for ID '%s'." % (stream, data_id))
+
+        if self.mode=='r':
+            if self._mmap is None:
+                self._mmap = np.memmap(self.filename, dtype='uint8', mode='r')
+            return self._mmap[offset:offset+nbytes].view('float32').reshape(shape)
+
+        self._fid.seek(offset)
+        return np.fromstring(self._fid.read(nbytes), dtype='float32').reshape(shape)
+
+    def get_attrs(self, data_id):
+        return self._d_index[str(data_id)]['attrs']
+
+    def get_streams(self, data_id):
+        '''
+        Returns a list of (name, shape) of the streams stored for an ID.
+        '''
+        return [ (name, tuple(shape)) for name, shape in self._d_index[str(data_id)]['streams'] ]
+
+    def keys(self):
+        return list(self._d_index.keys())
+
+    def flush(self):
+        '''
+        Writes the index (i.e., the file is consistent after this call).
+        '''
+        if (self.mode=='r') or self._b_idx_ok:
+            return
+        index = json.dumps(list(self._d_index.values())).encode('utf-8')
+        self._fid.seek(self._end)
+        self._fid.write(index)
+        self._fid.truncate()
+        self._write_header(self._end, len(index))
+        self._b_idx_ok = True
+        return
+
+    def close(self):
+        if self._fid is None:
+            return
+        self.flush()
+        self._fid.close()
+        self._fid  = None
+        self._mmap = None
+        return
+
+    def __contains__(self, data_id):
+        return str(data_id) in self._d_index
+
+    def __len__(self):
+        return len(self._d_index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return False
+
+    # Pickling (e.g., to be used by lu.run_batch workers). Only stores in read mode:
+    def __getstate__(self):
+        if self.mode != 'r':
+            raise TypeError('Only feature stores opened in read mode can be passed to other processes.')
+        return {'filename': self.filename}
+
+    def __setstate__(self, d_state):
+        self.__init__(d_state['filename'], mode='r')
+        return
+
 def add_rel_path(rel_path):
     import sys, os, inspect
     caller_file = inspect.stack()[1][1]
@@ -189,10 +665,13 @@ def ins_pid(filepath):
     Inserts pid plus host name to a file path.
     It is very useful when naming temp files, since it prevents that temp files from different instances overlap.
     Example: path/file.wav -> path/file_host_pid.wav
+    In threads other than the main one, the thread id is added too (e.g., run_batch with b_threads=True): path/file_host_pid_tid.wav
     '''
     filename, ext = os.path.splitext(filepath)
-    filename = "%s_%s_%d%s" % (filename, socket.gethostname(), os.getpid(), ext)
-    return filename
+    filename = "%s_%s_%d" % (filename, socket.gethostname(), os.getpid())
+    if threading.current_thread().name != 'MainThread':
+        filename += "_%d" % threading.current_thread().ident
+    return filename + ext
 
 # Inserts date and time to file name. This is useful for output files----------
 # Example: path/file.wav -> path/file_prefix_date_time.wav
@@ -15,8 +15,8 @@ import soundfile as sf
 from scipy import interpolate
 from scipy import signal
 import os
+import time
 import warnings
-from subprocess import call
 
 #==============================================================================
 # BODY
@@ -35,25 +35,19 @@ def ola(m_frm, v_pm, win_func=None):
 
     v_pm = v_pm.astype(int)
     nfrms, frmlen = m_frm.shape
-    v_sig = np.zeros(v_pm[-1] + frmlen)
 
     v_shift = la.pm_to_shift(v_pm)
     v_shift = np.append(v_shift, v_shift[-1]) # repeating last value
-    strt  = 0
-    for i in xrange(nfrms):
+    v_strt  = np.hstack((0, np.cumsum(v_shift[1:nfrms])))
 
-        if win_func is not None:
-            #g = m_frm[i,:].copy()
-            v_win = la.gen_centr_win(v_shift[i], v_shift[i+1], frmlen, win_func=win_func)
-            m_frm[i,:] *= v_win
+    # Windows (only one per distinct pair of left and right lengths):
+    m_win    = None
+    v_nx_win = None
+    if win_func is not None:
+        m_win, v_nx_win = la.centr_win_bank(v_shift[:nfrms], v_shift[1:(nfrms+1)], frmlen, win_func=win_func)
 
-            if False:
-                from libplot import lp
-                lp.figure(); lp.plot(v_win); lp.grid()
-
-        # Add frames:
-        v_sig[strt:(strt+frmlen)] += m_frm[i,:]
-        strt += v_shift[i+1]
+    # Add frames:
+    v_sig = la.ola_var_shift(m_frm, v_strt, sig_len=(v_pm[-1] + frmlen), m_win=m_win, v_nx_win=v_nx_win)
 
     # Cut ending and beginning:
     v_sig = v_sig[(frmlen/2 - v_pm[0]):]
@@ -118,6 +112,81 @@ def windowing(v_sig, v_pm, win_func=np.hanning):
         
     return l_frames, v_lens, v_pm_plus, v_shift, v_rights
 
+#==============================================================================
+def windowing_to_matrix(v_sig, v_pm, fft_len, win_func=np.hanning):
+    '''
+    Vectorised version of windowing + zero padding + "un-delay" (circular rotation to put the pitch mark at index 0).
+    Frames are gathered, windowed, and rotated straight into one (n_frms x fft_len) matrix.
+    Same frames as the per-frame loop in analysis_with_del_comp_from_pm. Frames longer than fft_len are truncated (with a warning).
+    win_func: None (boxcar), window function, or list of window functions (one per frame).
+    See also: windowing_plan (to frame several signals with the same pitch marks).
+    '''
+    v_nx_sig, v_nx_row, v_nx_col, v_win, v_lens, v_pm_plus, v_shift, v_rights = windowing_plan(np.size(v_sig), v_pm, fft_len, win_func=win_func)
+
+    v_data = v_sig[v_nx_sig]
+    if v_win is not None:
+        v_data = v_data * v_win
+
+    # Scatter into the (n_frms x fft_len) buffer, "un-delayed":
+    m_frms = np.zeros((len(v_shift), fft_len), dtype=np.float32 if v_sig.dtype==np.float32 else np.float64) # single precision kept
+    m_frms[v_nx_row, v_nx_col] = v_data
+
+    return m_frms, v_lens, v_pm_plus, v_shift, v_rights
+
+def windowing_plan(n_smpls, v_pm, fft_len, win_func=np.hanning):
+    '''
+    Gather/scatter plan used by windowing_to_matrix. It only depends on the signal length and the pitch marks.
+    One entry per stored sample: v_nx_sig (index in the signal), v_nx_row and v_nx_col (frame and position in the
+    un-delayed frame matrix), and v_win (window value, or None if win_func is None).
+    Also returns v_lens, v_pm_plus, v_shift, and v_rights (as windowing).
+    '''
+    # Round to int:
+    v_pm = lu.round_to_int(v_pm)
+
+    # Pitch Marks Extension:
+    v_pm_plus = np.hstack((0, v_pm, (n_smpls-1)))
+    v_lefts   = v_pm_plus[:-2]
+    v_shift   = v_pm_plus[1:-1] - v_lefts      # left lengths
+    v_rights  = v_pm_plus[2:] - v_pm_plus[1:-1] # right lengths
+    v_lens    = v_shift + v_rights + 1
+    n_frms    = len(v_shift)
+
+    # Truncation:
+    warnmess  = "fft_len (%d) is shorter than the current detected frame length (%d). "
+    warnmess += "This issue is not very critical, but if it occurs often "
+    warnmess += "(e.g., more than 3 times per utterance), please increase de FFT length."
+    for nx_frm in np.where(v_lens > fft_len)[0]:
+        warnings.warn(warnmess % (fft_len, v_lens[nx_frm]))
+
+    v_lens_trunc = np.minimum(v_lens, fft_len)
+    v_rot        = np.where(v_shift < fft_len, v_shift, 0) # same as the np.hstack rotation in the per-frame version
+
+    # Flat (ragged) gather indexes. Frame index, and position within the frame:
+    v_nx_row = np.repeat(np.arange(n_frms), v_lens_trunc)
+    v_nx_frm = np.arange(np.sum(v_lens_trunc)) - np.repeat(np.cumsum(v_lens_trunc) - v_lens_trunc, v_lens_trunc)
+    v_nx_sig = v_lefts[v_nx_row] + v_nx_frm
+    v_nx_col = (v_nx_frm - v_rot[v_nx_row]) % fft_len
+
+    # Windowing:
+    v_win = None
+    if win_func is not None:
+        if isinstance(win_func, list):
+            l_win_funcs = list(set(win_func))
+            v_nx_func   = np.array([ l_win_funcs.index(func) for func in win_func ])
+        else:
+            l_win_funcs = [win_func]
+            v_nx_func   = np.zeros(n_frms, dtype=int)
+
+        v_bank, v_offsets = la.half_win_bank(l_win_funcs, np.hstack((v_nx_func, v_nx_func)), np.hstack((v_shift, v_rights)))
+        v_offs_l = v_offsets[:n_frms][v_nx_row]
+        v_offs_r = v_offsets[n_frms:][v_nx_row]
+
+        # Left half: rising. Right half: falling (i.e., rising half read backwards).
+        v_nx_win = np.where(v_nx_frm <= v_shift[v_nx_row], v_offs_l + v_nx_frm, v_offs_r + v_lens[v_nx_row] - 1 - v_nx_frm)
+        v_win    = v_bank[v_nx_win]
+
+    return v_nx_sig, v_nx_row, v_nx_col, v_win, v_lens, v_pm_plus, v_shift, v_rights
+
 #==============================================================================
 # From (after) 'analysis_with_del_comp':
 # new: returns voi/unv decision.
@@ -203,59 +272,19 @@ def analysis_with_del_comp_from_pm_type2(v_in_sig, fs, v_pm_smpls, v_voi, fft_le
         m_pm_smpls_step = np.add(m_pm_smpls_step, v_pm_smpls[:-1])
         v_pm_smpls_defi = m_pm_smpls_step.flatten(order='F')
 
-    # Windowing:---------------------------------------------------------------
-    l_frms, v_lens, v_pm_plus, v_shift, v_rights = windowing(v_in_sig, v_pm_smpls_defi, win_func=win_func)
+    # Windowing (framed, windowed, and un-delayed into a (n_frms x fft_len) matrix):
+    m_frms, v_lens, v_pm_plus, v_shift, v_rights = windowing_to_matrix(v_in_sig, v_pm_smpls_defi, fft_len, win_func=win_func)
 
-    # FFT:---------------------------------------------------------------------
-    #len_max = np.max(v_lens) # max frame length in file
-    #if fft_len < len_max:
-    #    warnings.warn("fft_len (%d) is shorter than the maximum detected frame length (%d). " \
-    #                  + "This issue is not very critical, but if it occurs often (e.g., more than 3 times per utterance), " \
-    #                  + "please increase de FFT length." % (fft_len,len_max))
-
-    n_frms = len(l_frms)
-    m_frms = np.zeros((n_frms, fft_len))
-
-    # For paper:--------------------------------
-    #m_frms_orig = np.zeros((n_frms, fft_len))
-    # ------------------------------------------
-    warnmess  = "fft_len (%d) is shorter than the current detected frame length (%d). "
-    warnmess += "This issue is not very critical, but if it occurs often "
-    warnmess += "(e.g., more than 3 times per utterance), please increase de FFT length."
-    v_gain = np.zeros(n_frms)
+    # Gain:--------------------------------------------------------------------
+    # Voiced: max abs amplitude in the first half of the (un-delayed) frame. Unvoiced: std of the frame.
     fft_len_half = fft_len / 2 + 1
-    for f in xrange(n_frms):
-
-
-        if v_lens[f]<=fft_len:
-            m_frms[f,0:v_lens[f]] = l_frms[f]
-        else:
-            m_frms[f,:] = l_frms[f][:fft_len]
-            warnings.warn(warnmess % (fft_len, v_lens[f]))
-
-        # un-delay the signal:
-        v_curr_frm  = m_frms[f,:]
-
-        # For paper:----------------------------
-        #m_frms_orig[f,:] = v_curr_frm
-        # --------------------------------------
-        m_frms[f,:] = np.hstack((v_curr_frm[v_shift[f]:], v_curr_frm[0:v_shift[f]]))
-
-        # Gain:
-        if v_voi[f]==1: # voiced case:
-            v_gain[f] = np.max(np.abs(m_frms[f,:fft_len_half]))
-        else: # unv case:
-            #v_gain[f] = np.sqrt(np.mean(l_frms[f]**2)) # TODO: Improve (remove dc)
-            v_gain[f] = np.std(l_frms[f])
+    v_lens_trunc = np.minimum(v_lens, fft_len)
+    v_mean       = np.sum(m_frms, axis=1) / v_lens_trunc
+    v_var        = (np.sum(m_frms**2, axis=1) - v_lens_trunc * v_mean**2) / v_lens_trunc
+    v_gain       = np.where(v_voi==1, np.max(np.abs(m_frms[:,:fft_len_half]), axis=1), np.sqrt(np.maximum(v_var, 0.0)))
 
-    m_fft = np.fft.fft(m_frms)
-    m_sp  = np.absolute(m_fft)
-    m_ph  = np.angle(m_fft)
-
-    # Remove redundant second half:--------------------------------------------
-    m_sp  = la.remove_hermitian_half(m_sp)
-    m_ph  = la.remove_hermitian_half(m_ph)
-    m_fft = la.remove_hermitian_half(m_fft)
+    # FFT (non-redundant half only):------------------------------------------
+    m_fft = la.rfft_frames(m_frms)
 
     return m_fft, v_shift, v_gain
 
@@ -287,50 +316,12 @@ def analysis_with_del_comp_from_pm(v_in_sig, fs, v_pm_smpls, fft_len=None,
         m_pm_smpls_step = np.add(m_pm_smpls_step, v_pm_smpls[:-1])
         v_pm_smpls_defi = m_pm_smpls_step.flatten(order='F')
     
-    # Windowing:---------------------------------------------------------------    
-    l_frms, v_lens, v_pm_plus, v_shift, v_rights = windowing(v_in_sig, v_pm_smpls_defi, win_func=win_func)
-    
-    # FFT:---------------------------------------------------------------------
-    #len_max = np.max(v_lens) # max frame length in file
-    #if fft_len < len_max:
-    #    warnings.warn("fft_len (%d) is shorter than the maximum detected frame length (%d). " \
-    #                  + "This issue is not very critical, but if it occurs often (e.g., more than 3 times per utterance), " \
-    #                  + "please increase de FFT length." % (fft_len,len_max))
-    
-    n_frms = len(l_frms)
-    m_frms = np.zeros((n_frms, fft_len))
-    
-    # For paper:--------------------------------
-    #m_frms_orig = np.zeros((n_frms, fft_len))
-    # ------------------------------------------
-    warnmess  = "fft_len (%d) is shorter than the current detected frame length (%d). "
-    warnmess += "This issue is not very critical, but if it occurs often "
-    warnmess += "(e.g., more than 3 times per utterance), please increase de FFT length."
-    for f in xrange(n_frms):
-
-        if v_lens[f]<=fft_len:
-            m_frms[f,0:v_lens[f]] = l_frms[f]
-        else:
-            m_frms[f,:] = l_frms[f][:fft_len]
-            warnings.warn(warnmess % (fft_len, v_lens[f]))
+    # Windowing (framed, windowed, and un-delayed into a (n_frms x fft_len) matrix):
+    m_frms, v_lens, v_pm_plus, v_shift, v_rights = windowing_to_matrix(v_in_sig, v_pm_smpls_defi, fft_len, win_func=win_func)
 
-        # un-delay the signal:
-        v_curr_frm  = m_frms[f,:]     
-        
-        # For paper:----------------------------
-        #m_frms_orig[f,:] = v_curr_frm        
-        # --------------------------------------
-        m_frms[f,:] = np.hstack((v_curr_frm[v_shift[f]:], v_curr_frm[0:v_shift[f]]))
-                   
-    m_fft = np.fft.fft(m_frms)
-    m_sp  = np.absolute(m_fft) 
-    m_ph  = np.angle(m_fft) 
+    # FFT (non-redundant half only):------------------------------------------
+    m_fft = la.rfft_frames(m_frms)
 
-    # Remove redundant second half:--------------------------------------------
-    m_sp  = la.remove_hermitian_half(m_sp)
-    m_ph  = la.remove_hermitian_half(m_ph) 
-    m_fft = la.remove_hermitian_half(m_fft)
-    
     return m_fft, v_shift
 
 #==============================================================================
@@ -662,10 +653,9 @@ def synthesis_from_compressed_type1_old_with_griffin_lim(m_mag_mel_log, m_real_m
     if const_rate_ms>0.0:
         interp_type = 'linear' #'quadratic' , 'cubic'
         v_shift, v_frm_locs_smpls = get_shifts_and_frm_locs_from_const_shifts(v_shift, const_rate_ms, fs, interp_type=interp_type)
-        m_mag  = interp_from_const_to_variable_rate(m_mag,    v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_real = interp_from_const_to_variable_rate(m_real,   v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_imag = interp_from_const_to_variable_rate(m_imag,   v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        v_voi  = interp_from_const_to_variable_rate(v_f0>0.0, v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type) > 0.5
+        rs_plan = plan_const_to_variable_rate(np.size(m_mag,0), v_frm_locs_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag, v_voi = rs_plan.apply(m_mag, m_real, m_imag, v_f0>0.0)
+        v_voi  = v_voi > 0.5
         v_f0   = shift_to_f0(v_shift, v_voi, fs, out='f0', b_smooth=False)
         nfrms  = v_shift.size
     
@@ -802,16 +792,16 @@ def phase_uncompress_fbank(m_real_mel, m_imag_mel, crsf_cf, crsf_bw, alpha, fft_
     max_bin_ph = bin_cf # bin_l # bin_cf # bin_r # bin_l
 
     fft_len_half = 1 + fft_len/2
-    v_bins_mel   = la.build_mel_curve(alpha, fft_len_half)[:max_bin_ph]
+    fbank = la.get_mel_fbank(max_bin_ph, m_real_mel.shape[1], alpha=alpha, nbins_full=fft_len_half)
 
-    m_real_shrt = la.unwarp_from_fbank(m_real_mel, v_bins_mel, interp_kind='quadratic')
-    m_imag_shrt = la.unwarp_from_fbank(m_imag_mel, v_bins_mel, interp_kind='quadratic')
+    m_real_shrt = fbank.unwarp(m_real_mel, interp_kind='quadratic')
+    m_imag_shrt = fbank.unwarp(m_imag_mel, interp_kind='quadratic')
 
-    #m_real_shrt = la.unwarp_from_fbank(m_real_mel, v_bins_mel, interp_kind='cubic')
-    #m_imag_shrt = la.unwarp_from_fbank(m_imag_mel, v_bins_mel, interp_kind='cubic')
+    #m_real_shrt = fbank.unwarp(m_real_mel, interp_kind='cubic')
+    #m_imag_shrt = fbank.unwarp(m_imag_mel, interp_kind='cubic')
 
-    #m_real_shrt = la.unwarp_from_fbank(m_real_mel, v_bins_mel, interp_kind='slinear')
-    #m_imag_shrt = la.unwarp_from_fbank(m_imag_mel, v_bins_mel, interp_kind='slinear')
+    #m_real_shrt = fbank.unwarp(m_real_mel, interp_kind='slinear')
+    #m_imag_shrt = fbank.unwarp(m_imag_mel, interp_kind='slinear')
 
     nfrms  = m_real_mel.shape[0]
     m_real = np.hstack((m_real_shrt, m_real_shrt[:,-1][:,None] + np.zeros((nfrms, fft_len_half-max_bin_ph))))
@@ -823,27 +813,150 @@ def phase_uncompress_fbank(m_real_mel, m_imag_mel, crsf_cf, crsf_bw, alpha, fft_
 
 #==============================================================================
 def synthesis_from_compressed(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs, fft_len=None, b_voi_ap_win=True,
-                                    b_fbank_mel=False, b_const_rate=False, per_phase_type='magphase', alpha_phase=None, b_out_hpf=True):
+                                    b_fbank_mel=False, b_const_rate=False, per_phase_type='magphase', alpha_phase=None, b_out_hpf=True, dtype='float64'):
 
     '''
     synthesis_from_compressed_type1 with phase compression based on filter bank. It didn't work very well according to experiments.
 
     b_fbank_mel: If True, Mel compression done by the filter bank approach. Otherwise, it uses sptk mcep related funcs.
     per_phase_type: 'magphase', 'min_phase', or 'linear'
+    dtype: 'float64' or 'float32'. Precision of the computation and the output signal. 'float32' halves the memory
+           (and memory bandwidth) used by the spectra and frames (pitch marks are always computed in double precision).
+    See also: SynthesisStream (streaming version), and synthesis_from_compressed_batch (several utterances at once).
+    '''
+    return synthesis_from_compressed_batch([(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0)], fs, fft_len=fft_len, b_voi_ap_win=b_voi_ap_win,
+                            b_fbank_mel=b_fbank_mel, b_const_rate=b_const_rate, per_phase_type=per_phase_type, alpha_phase=alpha_phase,
+                            b_out_hpf=b_out_hpf, dtype=dtype)[0]
+
+#==============================================================================
+def synthesis_from_compressed_batch(l_feats, fs, fft_len=None, b_voi_ap_win=True, b_fbank_mel=False, b_const_rate=False,
+                                    per_phase_type='magphase', alpha_phase=None, b_out_hpf=True, dtype='float64'):
+    '''
+    Synthesises several utterances at once. Same output as calling synthesis_from_compressed for each utterance (in the same order).
+    l_feats: List of tuples (m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0), one per utterance.
+    The frames of all the utterances are concatenated, so Mel unwarping, noise spectra, mask generation, spectral shaping, and
+    FFTs are computed in large batches. Then, frames are split back for the overlap-add. This reduces the per-call overhead
+    when synthesising many short utterances. Memory grows with the total number of frames (see synthesis_from_acoustic_modelling_batch).
+    Other params: see synthesis_from_compressed.
+    Returns a list of signals (one per utterance).
     '''
 
     # Setting up constants:====================================================
-    crsf_cf, crsf_bw = define_crossfade_params(fs)
-    alpha = define_alpha(fs)
     if fft_len==None:
         fft_len = define_fft_len(fs)
+    plan   = get_synthesis_plan(fs, fft_len)
+    n_utts = len(l_feats)
+    if n_utts==0:
+        return []
+
+    def concat(l_data):
+        return l_data[0] if len(l_data)==1 else np.concatenate(l_data)
+
+    v_nfrms = np.array([ np.size(feats[0], 0) for feats in l_feats ])
+    v_bnds  = np.r_[0, np.cumsum(v_nfrms)]
+
+    m_mag_mel_log = concat([ np.asarray(feats[0], dtype=dtype) for feats in l_feats ])
+    m_real_mel    = concat([ np.asarray(feats[1], dtype=dtype) for feats in l_feats ])
+    m_imag_mel    = concat([ np.asarray(feats[2], dtype=dtype) for feats in l_feats ])
+    v_lf0         = concat([ np.asarray(feats[3]) for feats in l_feats ])
+
+    # Unwarp and unlog features (all utterances):==============================
+    m_mag, m_real, m_imag, v_shift, v_voi = uncompress_feats(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs, fft_len,
+                                                            b_fbank_mel=b_fbank_mel, alpha_phase=alpha_phase)
+
+    # Per utterance: Constant to variable frame rate, pitch marks, and noise frames:
+    l_mag, l_real, l_imag, l_voi, l_shift, l_pm, l_frm_ns = [], [], [], [], [], [], []
+    for nx_utt in xrange(n_utts):
+        v_nx_frms = slice(v_bnds[nx_utt], v_bnds[nx_utt+1])
+        m_mag_utt, m_real_utt, m_imag_utt = m_mag[v_nx_frms], m_real[v_nx_frms], m_imag[v_nx_frms]
+        v_shift_utt, v_voi_utt = v_shift[v_nx_frms], v_voi[v_nx_frms]
+
+        if b_const_rate:
+            const_rate_ms = 5.0
+            interp_type = 'linear' #'quadratic' , 'cubic'
+            v_shift_utt, v_frm_locs_smpls = get_shifts_and_frm_locs_from_const_shifts(v_shift_utt, const_rate_ms, fs, interp_type=interp_type)
+            rs_plan = plan_const_to_variable_rate(np.size(m_mag_utt,0), v_frm_locs_smpls, const_rate_ms, fs) # (linear interp.)
+            m_mag_utt, m_real_utt, m_imag_utt, v_voi_utt = rs_plan.apply(m_mag_utt, m_real_utt, m_imag_utt, v_voi_utt)
+            v_voi_utt = v_voi_utt > 0.5
+
+        # Noise Gen:
+        v_shift_utt = v_shift_utt.astype(int)
+        v_pm_utt    = la.shift_to_pm(v_shift_utt)
+
+        ns_len = v_pm_utt[-1] + (v_pm_utt[-1] - v_pm_utt[-2])
+        v_ns   = np.random.uniform(-1, 1, ns_len).astype(dtype, copy=False)
+
+        l_mag.append(m_mag_utt)
+        l_real.append(m_real_utt)
+        l_imag.append(m_imag_utt)
+        l_voi.append(v_voi_utt)
+        l_shift.append(v_shift_utt)
+        l_pm.append(v_pm_utt)
+        l_frm_ns.append(noise_frames(v_ns, v_pm_utt, v_voi_utt, fft_len, b_voi_ap_win=b_voi_ap_win))
+
+    if b_const_rate:
+        m_mag, m_real, m_imag, v_voi = concat(l_mag), concat(l_real), concat(l_imag), concat(l_voi)
+        v_nfrms = np.array([ len(v_shift_utt) for v_shift_utt in l_shift ])
+        v_bnds  = np.r_[0, np.cumsum(v_nfrms)]
+
+    # Aperiodic Spectrum Generation (all utterances):============================
+    # Noise complex spectrum:
+    m_ns_cmplx_spec = la.rfft_frames(concat(l_frm_ns))
+    del l_frm_ns
+
+    # Noise gain normalisation (per utterance):
+    for nx_utt in xrange(n_utts):
+        m_ns_cmplx_spec_utt = m_ns_cmplx_spec[v_bnds[nx_utt]:v_bnds[nx_utt+1]] # view
+        v_voi_utt = v_voi[v_bnds[nx_utt]:v_bnds[nx_utt+1]]
+        m_ns_mag  = np.absolute(m_ns_cmplx_spec_utt)
+
+        noise_gain_voi = np.sqrt(np.exp(np.mean(la.log(m_ns_mag[v_voi_utt,1:-1])**2)))
+        noise_gain_unv = np.sqrt(np.exp(np.mean(la.log(m_ns_mag[~v_voi_utt,1:-1])**2)))
+
+        m_ns_cmplx_spec_utt[v_voi_utt,:]  = m_ns_cmplx_spec_utt[v_voi_utt,:] /  noise_gain_voi
+        m_ns_cmplx_spec_utt[~v_voi_utt,:] = m_ns_cmplx_spec_utt[~v_voi_utt,:] / noise_gain_unv
+
+    # Waveform Generation (all utterances):====================================
+    m_syn_frms = gen_frames_from_spectra(m_mag, m_real, m_imag, m_ns_cmplx_spec, v_voi, fs, per_phase_type=per_phase_type, plan=plan)
+    del m_mag, m_real, m_imag, m_ns_cmplx_spec
+
+    # Overlap-add (per utterance):=============================================
+    frmlen = m_syn_frms.shape[1]
+    l_syn_sig = []
+    for nx_utt in xrange(n_utts):
+        m_syn_frms_utt = m_syn_frms[v_bnds[nx_utt]:v_bnds[nx_utt+1]] # view
+        v_shift_utt    = l_shift[nx_utt]
+        nfrms          = v_shift_utt.size
+
+        # Window anti-ringing:
+        v_shift_ext = np.r_[v_shift_utt[0], v_shift_utt, v_shift_utt[-1], v_shift_utt[-1]] # recover first shift (estimate)
+        m_win, v_nx_win = la.centr_win_bank(v_shift_ext[:nfrms]+v_shift_ext[1:(nfrms+1)], v_shift_ext[2:(nfrms+2)]+v_shift_ext[3:(nfrms+3)],
+                                                                frmlen, win_func=raised_hanning, b_fill_w_bound_val=True)
+        m_syn_frms_utt *= m_win.astype(m_syn_frms.dtype, copy=False)[v_nx_win,:]
+
+        v_syn_sig = ola(m_syn_frms_utt, l_pm[nx_utt], win_func=None)
+
+        # HPF - Output:
+        # NOTE: The HPF unbalance the polarity of the signal, because it removed DC!
+        if b_out_hpf:
+            v_syn_sig = signal.lfilter(plan.v_hpf_b, plan.v_hpf_a, v_syn_sig).astype(dtype, copy=False)
 
+        l_syn_sig.append(v_syn_sig)
+
+    return l_syn_sig
+
+#==============================================================================
+def uncompress_feats(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs, fft_len, b_fbank_mel=False, alpha_phase=None):
+    '''
+    Compressed features to full resolution magnitude, real, and imag spectra (frame by frame), plus shifts and voicing.
+    Spectra have the same precision as the input (float32 or float64). Shifts are always computed in double precision.
+    Used by synthesis_from_compressed and SynthesisStream.
+    '''
+    alpha        = define_alpha(fs)
     fft_len_half = fft_len / 2 + 1
-    nfrms, ncoeffs_mag = m_mag_mel_log.shape
 
-    # Unwarp and unlog features:===============================================
     # F0:
-    v_f0    = np.exp(v_lf0)
+    v_f0    = np.exp(np.asarray(v_lf0, dtype='float64'))
     v_voi   = v_f0 > 1.0 # case voiced  (1.0 is used for safety)
     v_shift = f0_to_shift(v_f0, fs)
 
@@ -857,30 +970,21 @@ def synthesis_from_compressed(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs,
         alpha_phase = alpha
     m_real, m_imag = phase_uncompress_type1_mcep(m_real_mel, m_imag_mel, alpha_phase, fft_len, fs)
 
-    # Constant to variable frame rate:============================================
-    if b_const_rate:
-        const_rate_ms = 5.0
-        interp_type = 'linear' #'quadratic' , 'cubic'
-        v_shift, v_frm_locs_smpls = get_shifts_and_frm_locs_from_const_shifts(v_shift, const_rate_ms, fs, interp_type=interp_type)
-        m_mag  = interp_from_const_to_variable_rate(m_mag,    v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_real = interp_from_const_to_variable_rate(m_real,   v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_imag = interp_from_const_to_variable_rate(m_imag,   v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        v_voi  = interp_from_const_to_variable_rate(v_voi, v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type) > 0.5
-        v_f0   = shift_to_f0(v_shift, v_voi, fs, out='f0', b_smooth=False)
-        nfrms  = v_shift.size
-
-    # Mask Generation:============================================================
-    m_mask_per = np.zeros(m_mag.shape)
-    m_ones     = np.ones((np.sum(v_voi.astype(int)), fft_len_half))
-    m_mask_per[v_voi,:] = la.spectral_crossfade(m_ones, m_mask_per[v_voi,:], crsf_cf, crsf_bw, fs, freq_scale='hz', win_func=np.hanning)
+    return m_mag, m_real, m_imag, v_shift, v_voi
 
-    # Aperiodic Spectrum Generation:==============================================
-    # Noise Gen:
-    v_shift = v_shift.astype(int)
-    v_pm    = la.shift_to_pm(v_shift)
+#==============================================================================
+def noise_frames_spec(v_ns, v_pm, v_voi, fft_len, b_voi_ap_win=True):
+    '''
+    Pitch synchronous noise frames (centred at the pitch marks v_pm) to complex spectrum (non-redundant half).
+    b_voi_ap_win: If True, voiced frames are windowed with voi_noise_window. Otherwise, hanning for all frames.
+    '''
+    return la.rfft_frames(noise_frames(v_ns, v_pm, v_voi, fft_len, b_voi_ap_win=b_voi_ap_win))
 
-    ns_len = v_pm[-1] + (v_pm[-1] - v_pm[-2])
-    v_ns   = np.random.uniform(-1, 1, ns_len)
+def noise_frames(v_ns, v_pm, v_voi, fft_len, b_voi_ap_win=True):
+    '''
+    Pitch synchronous windowed noise frames (un-delayed, (n_frms x fft_len) matrix). See noise_frames_spec.
+    '''
+    nfrms = len(v_pm)
 
     # Noise Windowing:
     l_ns_win_funcs = [ np.hanning ] * nfrms
@@ -889,70 +993,52 @@ def synthesis_from_compressed(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs,
             if v_voi[i]:
                 l_ns_win_funcs[i] = voi_noise_window
 
-    l_frm_ns, v_lens, v_pm_plus, v_shift_dummy, v_rights = windowing(v_ns, v_pm, win_func=l_ns_win_funcs)
-
-    # Noise complex spectrum:
-    m_frm_ns = la.frm_list_to_matrix(l_frm_ns, v_shift, fft_len)
-    m_frm_ns = np.fft.fftshift(m_frm_ns, axes=1)
-    m_ns_cmplx_spec = la.remove_hermitian_half(np.fft.fft(m_frm_ns))
+    # Framing (the un-delayed layout is the same as frm_list_to_matrix + fftshift):
+    m_frm_ns = windowing_to_matrix(v_ns, v_pm, fft_len, win_func=l_ns_win_funcs)[0]
 
-    # Noise gain normalisation:
-    m_ns_mag  = np.absolute(m_ns_cmplx_spec)
+    return m_frm_ns
 
-    noise_gain_voi = np.sqrt(np.exp(np.mean(la.log(m_ns_mag[v_voi,1:-1])**2)))
-    noise_gain_unv = np.sqrt(np.exp(np.mean(la.log(m_ns_mag[~v_voi,1:-1])**2)))
-
-    m_ns_cmplx_spec[v_voi,:]  = m_ns_cmplx_spec[v_voi,:] /  noise_gain_voi
-    m_ns_cmplx_spec[~v_voi,:] = m_ns_cmplx_spec[~v_voi,:] / noise_gain_unv
-
-    # Spectral Stamping of magnitude to noise spectrum:
-    b_ap_min_phase_mag = False
-    if b_ap_min_phase_mag:
-        m_mag_min_phase_cmplx = la.build_min_phase_from_mag_spec(m_mag)
-    else:
-        m_mag_min_phase_cmplx = m_mag
-
-    m_ap_cmplx_spec = m_ns_cmplx_spec * m_mag_min_phase_cmplx
+#==============================================================================
+def gen_frames_from_spectra(m_mag, m_real, m_imag, m_ns_cmplx_spec, v_voi, fs, per_phase_type='magphase', plan=None):
+    '''
+    Periodic and aperiodic spectra generation, mixing, and synthesis of the (fftshifted) waveform frames.
+    Works frame by frame. m_ns_cmplx_spec: Normalised noise complex spectrum.
+    plan: SynthesisPlan. If None, the cached one for fs is used (see get_synthesis_plan).
+    Used by synthesis_from_compressed and SynthesisStream.
+    '''
+    if plan is None:
+        plan = get_synthesis_plan(fs, (m_mag.shape[1] - 1) * 2)
 
-    v_line = la.db(la.build_mel_curve(alpha, fft_len_half, amp=3.5) - 3.5, b_inv=True)
-    m_ap_cmplx_spec[~v_voi,:] *= v_line
+    nbins_per = plan.nbins_per
 
+    # Aperiodic Spectrum Generation:=============================================
+    # Spectral Stamping of magnitude to noise spectrum, and shaping (compensation curve for unvoiced frames,
+    # and crossfade mask for voiced frames. See SynthesisPlan):
+    m_syn_cmplx = m_ns_cmplx_spec * m_mag
+    m_syn_cmplx[~v_voi,:] *= plan.v_line_ap
+    m_syn_cmplx[v_voi,:]  *= plan.v_gain_ap_voi
 
     # Periodic Spectrum Generation:============================================
+    # Only voiced frames, and bins below the end of the crossfade (the mask is zero above).
+    v_gain_per = plan.v_gain_per_voi[:nbins_per].astype(m_mag.dtype)
     if per_phase_type=='magphase':
-        m_per_cmplx_ph = m_real + m_imag * 1j
+        m_per_cmplx_ph = m_real[v_voi,:nbins_per] + m_imag[v_voi,:nbins_per] * 1j
 
         # Normalisation and protection:
         m_per_cmplx_ph_mag = np.absolute(m_per_cmplx_ph)
         m_per_cmplx_ph_mag[m_per_cmplx_ph_mag==0.0] = 1.0
-        m_per_cmplx_ph = m_per_cmplx_ph / m_per_cmplx_ph_mag
 
-        m_per_cmplx_spec = m_mag * m_per_cmplx_ph
+        m_per_cmplx_spec = m_per_cmplx_ph * ((m_mag[v_voi,:nbins_per] * v_gain_per) / m_per_cmplx_ph_mag)
 
-    if per_phase_type=='linear':
-        m_per_cmplx_spec = m_mag
+    elif per_phase_type=='linear':
+        m_per_cmplx_spec = m_mag[v_voi,:nbins_per] * v_gain_per
 
     elif per_phase_type=='min_phase':
-        m_per_cmplx_spec  = la.build_min_phase_from_mag_spec(m_mag)
-
-    # Debug. Voi segments - compensation filter: # Not really noticeable.
-    # (NOTE: This only has been tested with fs=48kHz and alpha=0.77)
-    v_line = la.db(la.build_mel_curve(0.6, fft_len_half, amp=2.0), b_inv=True)
-    m_per_cmplx_spec[v_voi,:] *= v_line
-
+        m_per_cmplx_spec = la.build_min_phase_from_mag_spec(m_mag[v_voi,:])[:,:nbins_per] * v_gain_per
 
     # Waveform Generation:=====================================================
-    # Applying mask:
-    crsf_curve_fact = 0.5 # Spectral crossfade courve factor
-    m_per_cmplx_spec *= (m_mask_per**crsf_curve_fact)
-    m_ap_cmplx_spec  *= ((1 - m_mask_per)**crsf_curve_fact)
-
-    # Protection:
-    m_per_cmplx_spec[m_mask_per==0.0] = 0 + 0j
-    m_ap_cmplx_spec[m_mask_per==1.0]  = 0 + 0j
-
-    # Synthesis:
-    m_syn_cmplx = m_per_cmplx_spec + m_ap_cmplx_spec
+    # Mixing:
+    m_syn_cmplx[v_voi,:nbins_per] += m_per_cmplx_spec
 
     #Protection:
     m_syn_cmplx[:,0].real  = np.absolute(m_syn_cmplx[:,0])
@@ -960,41 +1046,257 @@ def synthesis_from_compressed(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs,
     m_syn_cmplx[:,0].imag  = 0.0
     m_syn_cmplx[:,-1].imag = 0.0
 
-    m_syn_cmplx = la.add_hermitian_half(m_syn_cmplx, data_type='complex')
-    m_syn_frms  = np.fft.ifft(m_syn_cmplx).real
+    m_syn_frms  = la.irfft_frames(m_syn_cmplx)
     m_syn_frms  = np.fft.fftshift(m_syn_frms, axes=1)
 
+    return m_syn_frms
 
-    # Window anti-ringing:
-    frmlen = m_syn_frms.shape[1]
-    v_shift_ext = np.r_[v_shift[0], v_shift, v_shift[-1], v_shift[-1]] # recover first shift (estimate)
-    for nxf in xrange(nfrms):
-        v_win = la.gen_centr_win(v_shift_ext[nxf]+v_shift_ext[nxf+1], v_shift_ext[nxf+2]+v_shift_ext[nxf+3], frmlen, win_func=raised_hanning, b_fill_w_bound_val=True)
-        m_syn_frms[nxf,:] *= v_win
+#==============================================================================
+def out_hpf_coeffs(fs):
+    '''
+    Output high-pass filter (Butterworth) coefficients.
+    '''
+    order = 4
+    fc = 40 # in Hz
+    fc_norm = fc /(fs/2.0)
+    v_b, v_a = signal.butter(order, fc_norm, btype='highpass')
+    return v_b, v_a
 
+#==============================================================================
+class SynthesisPlan(object):
+    '''
+    Constants used by synthesis_from_compressed and SynthesisStream that only depend on the configuration (fs, fft_len):
+    crossfade parameters and mask, alpha, compensation curves, spectral shaping gains, and output HPF coefficients.
+    Arrays are read-only, since plans are shared (see get_synthesis_plan).
+    '''
+    def __init__(self, fs, fft_len=None):
+        if fft_len is None:
+            fft_len = define_fft_len(fs)
+
+        self.fs           = fs
+        self.fft_len      = fft_len
+        self.fft_len_half = fft_len / 2 + 1
+        self.alpha        = define_alpha(fs)
+        self.crsf_cf, self.crsf_bw = define_crossfade_params(fs)
+
+        # Periodic mask for voiced frames (spectral crossfade from ones to zeros):
+        self.v_mask_per = la.spectral_crossfade(np.ones((1, self.fft_len_half)), np.zeros((1, self.fft_len_half)), self.crsf_cf,
+                                                            self.crsf_bw, fs, freq_scale='hz', win_func=np.hanning)[0]
+
+        # Compensation curves for unvoiced aperiodic and voiced periodic spectra:
+        self.v_line_ap  = la.db(la.build_mel_curve(self.alpha, self.fft_len_half, amp=3.5) - 3.5, b_inv=True)
+        self.v_line_per = la.db(la.build_mel_curve(0.6, self.fft_len_half, amp=2.0), b_inv=True)
+
+        # Gains applied to voiced frames: periodic (compensation curve and mask), and aperiodic (inverse mask).
+        # The mask is zero from bin nbins_per upwards, so the periodic spectrum is only generated below it.
+        crsf_curve_fact = 0.5 # Spectral crossfade courve factor
+        self.v_gain_per_voi = self.v_line_per * (self.v_mask_per**crsf_curve_fact)
+        self.v_gain_ap_voi  = (1 - self.v_mask_per)**crsf_curve_fact
+        self.nbins_per      = np.max(np.nonzero(self.v_mask_per)[0]) + 1
+
+        # Output HPF:
+        self.v_hpf_b, self.v_hpf_a = out_hpf_coeffs(fs)
+
+        for v_data in [self.v_mask_per, self.v_line_ap, self.v_line_per, self.v_gain_per_voi, self.v_gain_ap_voi, self.v_hpf_b, self.v_hpf_a]:
+            v_data.flags.writeable = False
+        return
 
-    v_syn_sig = ola(m_syn_frms, v_pm, win_func=None)
+_synth_plan_cache = lu.LRUCache(maxsize=8)
 
-    # HPF - Output:============================================================
-    # NOTE: The HPF unbalance the polarity of the signal, because it removed DC!
+def get_synthesis_plan(fs, fft_len=None):
+    '''
+    Returns the SynthesisPlan for (fs, fft_len). It is computed only once per configuration and process.
+    '''
+    if fft_len is None:
+        fft_len = define_fft_len(fs)
 
-    if b_out_hpf:
+    key  = (fs, fft_len)
+    plan = _synth_plan_cache.get(key)
+    if plan is None:
+        plan = SynthesisPlan(fs, fft_len)
+        _synth_plan_cache.put(key, plan)
+    return plan
+
+#==============================================================================
+class SynthesisStream(object):
+    '''
+    Streaming (block by block) version of synthesis_from_compressed, for low latency synthesis (e.g., interactive TTS).
+    Feature blocks (any number of frames) are given as the acoustic model emits them, and the audio that is already
+    final is returned straight away. The state between blocks (pending frames, noise, OLA tail, and HPF state) is kept internally.
+
+    Usage:
+        stream = SynthesisStream(fs)
+        for m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0 in blocks:
+            v_chunk = stream.process(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0)
+        v_chunk = stream.flush() # end of utterance
+
+    Algorithmic latency: 2 frames (look ahead needed by the noise and anti-ringing windows) plus fft_len/2 samples.
+
+    Differences with synthesis_from_compressed:
+    - The noise gains are running estimates over the frames received so far, instead of averages over the whole utterance.
+      If the whole utterance is given in one block, the output is the same as synthesis_from_compressed.
+    - Only variable frame rate features are supported (i.e., b_const_rate=False). The constant to variable frame rate
+      conversion used by synthesis_from_compressed goes backwards from the end of the utterance.
+    '''
+    def __init__(self, fs, fft_len=None, b_voi_ap_win=True, b_fbank_mel=False, per_phase_type='magphase', alpha_phase=None, b_out_hpf=True):
+        if fft_len is None:
+            fft_len = define_fft_len(fs)
+
+        self.fs             = fs
+        self.fft_len        = fft_len
+        self.b_voi_ap_win   = b_voi_ap_win
+        self.b_fbank_mel    = b_fbank_mel
+        self.per_phase_type = per_phase_type
+        self.alpha_phase    = alpha_phase
+        self.b_out_hpf      = b_out_hpf
+        self.plan           = get_synthesis_plan(fs, fft_len)
+
+        self.reset()
+        return
+
+    def reset(self):
+        '''
+        Clears the state to start a new utterance.
         '''
-        fc    = 60
-        order = 4
-        fc_norm   = fc / (fs / 2.0)
-        bc, ac    = signal.ellip(order,0.5 , 80, fc_norm, btype='highpass')
-        v_syn_sig = signal.lfilter(bc, ac, v_syn_sig)
-        #'''
-
-        # Butterworth:
-        order = 4
-        fc = 40 # in Hz
-        fc_norm = fc /(fs/2.0)
-        v_b, v_a = signal.butter(order, fc_norm, btype='highpass')
-        v_syn_sig = signal.lfilter(v_b, v_a, v_syn_sig)
+        fft_len_half = self.fft_len / 2 + 1
 
-    return v_syn_sig
+        # Pending frames (received, but not synthesised yet):
+        self.m_mag   = np.zeros((0, fft_len_half))
+        self.m_real  = np.zeros((0, fft_len_half))
+        self.m_imag  = np.zeros((0, fft_len_half))
+        self.v_voi   = np.zeros(0, dtype=bool)
+        self.v_shift = np.zeros(0, dtype=int)
+        self.v_pm    = np.zeros(0, dtype=int) # absolute (in samples)
+
+        self.prev_shift = None # Shift of the last synthesised frame.
+        self.prev_pm    = 0    # Pitch mark of the last synthesised frame.
+
+        # Noise (absolute position of the first stored sample):
+        self.v_ns   = np.zeros(0)
+        self.ns_pos = 0
+
+        # Noise gains (running estimates):
+        self.v_ns_log_sum = np.zeros(2) # unvoiced, voiced
+        self.v_ns_log_cnt = np.zeros(2)
+
+        # OLA (absolute position of the first sample in the OLA buffer, and number of output samples already returned):
+        self.v_ola   = np.zeros(0)
+        self.ola_pos = - (self.fft_len / 2)
+        self.n_out   = 0
+
+        # HPF:
+        if self.b_out_hpf:
+            self.v_hpf_zi = np.zeros(max(len(self.plan.v_hpf_a), len(self.plan.v_hpf_b)) - 1)
+
+        return
+
+    def process(self, m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0):
+        '''
+        Adds a block of compressed features (same format as synthesis_from_compressed) and returns the new audio samples.
+        '''
+        m_mag, m_real, m_imag, v_shift, v_voi = uncompress_feats(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, self.fs, self.fft_len,
+                                                                    b_fbank_mel=self.b_fbank_mel, alpha_phase=self.alpha_phase)
+        v_shift = v_shift.astype(int)
+        last_pm = self.v_pm[-1] if len(self.v_pm)>0 else self.prev_pm
+
+        self.m_mag   = np.vstack((self.m_mag,  m_mag))
+        self.m_real  = np.vstack((self.m_real, m_real))
+        self.m_imag  = np.vstack((self.m_imag, m_imag))
+        self.v_voi   = np.hstack((self.v_voi,   v_voi))
+        self.v_shift = np.hstack((self.v_shift, v_shift))
+        self.v_pm    = np.hstack((self.v_pm,    last_pm + np.cumsum(v_shift)))
+
+        # Frames with enough look ahead (2 frames):
+        return self._synth(len(self.v_shift) - 2, b_last=False)
+
+    def flush(self):
+        '''
+        Synthesises the remaining frames (end of utterance), and returns the last audio samples. Then, the state is reset.
+        '''
+        v_sig = self._synth(len(self.v_shift), b_last=True)
+        self.reset()
+        return v_sig
+
+    def _synth(self, nfrms, b_last):
+        if nfrms<=0:
+            return np.zeros(0)
+
+        fft_len = self.fft_len
+        v_shift = self.v_shift
+        v_pm    = self.v_pm[:nfrms]
+        v_voi   = self.v_voi[:nfrms]
+
+        # Noise:---------------------------------------------------------------
+        # Segment from the previous pitch mark to the next one (at the end of the utterance, as in synthesis_from_compressed).
+        if b_last:
+            ns_end = v_pm[-1] + v_shift[nfrms-1] - 1
+        else:
+            ns_end = self.v_pm[nfrms]
+
+        n_new = ns_end + 1 - (self.ns_pos + len(self.v_ns))
+        if n_new > 0:
+            self.v_ns = np.hstack((self.v_ns, np.random.uniform(-1, 1, n_new)))
+
+        v_ns_seg = self.v_ns[(self.prev_pm - self.ns_pos):(ns_end + 1 - self.ns_pos)]
+        m_ns_cmplx_spec = noise_frames_spec(v_ns_seg, v_pm - self.prev_pm, v_voi, fft_len, b_voi_ap_win=self.b_voi_ap_win)
+
+        # Noise gain normalisation (running):
+        m_ns_log2 = la.log(np.absolute(m_ns_cmplx_spec[:,1:-1]))**2
+        for nx_voi in [0, 1]:
+            v_nx_frms = (v_voi==bool(nx_voi))
+            self.v_ns_log_sum[nx_voi] += np.sum(m_ns_log2[v_nx_frms,:])
+            self.v_ns_log_cnt[nx_voi] += m_ns_log2[v_nx_frms,:].size
+            if np.any(v_nx_frms):
+                m_ns_cmplx_spec[v_nx_frms,:] /= np.sqrt(np.exp(self.v_ns_log_sum[nx_voi] / self.v_ns_log_cnt[nx_voi]))
+
+        # Frames:--------------------------------------------------------------
+        m_syn_frms = gen_frames_from_spectra(self.m_mag[:nfrms], self.m_real[:nfrms], self.m_imag[:nfrms], m_ns_cmplx_spec,
+                                                                            v_voi, self.fs, per_phase_type=self.per_phase_type, plan=self.plan)
+
+        # Window anti-ringing (same shifts as synthesis_from_compressed, i.e., 1 shift back and 2 ahead):
+        prev_shift  = v_shift[0] if self.prev_shift is None else self.prev_shift
+        v_shift_ext = np.r_[prev_shift, v_shift, v_shift[-1], v_shift[-1]]
+        m_win, v_nx_win = la.centr_win_bank(v_shift_ext[:nfrms]+v_shift_ext[1:(nfrms+1)], v_shift_ext[2:(nfrms+2)]+v_shift_ext[3:(nfrms+3)],
+                                                                fft_len, win_func=raised_hanning, b_fill_w_bound_val=True)
+
+        # OLA:-----------------------------------------------------------------
+        # Frames are centred at their pitch marks.
+        ola_end = v_pm[-1] + fft_len - (fft_len / 2)
+        if ola_end > (self.ola_pos + len(self.v_ola)):
+            self.v_ola = np.hstack((self.v_ola, np.zeros(ola_end - self.ola_pos - len(self.v_ola))))
+        self.v_ola += la.ola_var_shift(m_syn_frms, v_pm - (fft_len / 2) - self.ola_pos, sig_len=len(self.v_ola), m_win=m_win, v_nx_win=v_nx_win)
+
+        # Output. Samples before the first sample of the next frame are final:
+        if b_last:
+            out_end = v_pm[-1] + v_shift[nfrms-1] + 1
+        else:
+            out_end = self.v_pm[nfrms] - (fft_len / 2)
+
+        out_strt = max(self.n_out, self.ola_pos)
+        v_sig    = self.v_ola[(out_strt - self.ola_pos):(out_end - self.ola_pos)]
+        if out_end > out_strt:
+            self.v_ola   = self.v_ola[(out_end - self.ola_pos):]
+            self.ola_pos = out_end
+            self.n_out   = out_end
+
+        # HPF:
+        if self.b_out_hpf and (len(v_sig) > 0):
+            v_sig, self.v_hpf_zi = signal.lfilter(self.plan.v_hpf_b, self.plan.v_hpf_a, v_sig, zi=self.v_hpf_zi)
+
+        # Update state:--------------------------------------------------------
+        self.prev_shift = v_shift[nfrms-1]
+        self.prev_pm    = v_pm[-1]
+        self.v_ns       = self.v_ns[(self.prev_pm - self.ns_pos):]
+        self.ns_pos     = self.prev_pm
+
+        self.m_mag   = self.m_mag[nfrms:]
+        self.m_real  = self.m_real[nfrms:]
+        self.m_imag  = self.m_imag[nfrms:]
+        self.v_voi   = self.v_voi[nfrms:]
+        self.v_shift = self.v_shift[nfrms:]
+        self.v_pm    = self.v_pm[nfrms:]
+
+        return v_sig
 
 #==============================================================================
 def synthesis_from_compressed_type1_with_phase_comp(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs, fft_len=None,
@@ -1043,10 +1345,9 @@ def synthesis_from_compressed_type1_with_phase_comp(m_mag_mel_log, m_real_mel, m
     if const_rate_ms>0.0:
         interp_type = 'linear' #'quadratic' , 'cubic'
         v_shift, v_frm_locs_smpls = get_shifts_and_frm_locs_from_const_shifts(v_shift, const_rate_ms, fs, interp_type=interp_type)
-        m_mag  = interp_from_const_to_variable_rate(m_mag,    v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_real = interp_from_const_to_variable_rate(m_real,   v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_imag = interp_from_const_to_variable_rate(m_imag,   v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        v_voi  = interp_from_const_to_variable_rate(v_voi, v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type) > 0.5
+        rs_plan = plan_const_to_variable_rate(np.size(m_mag,0), v_frm_locs_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag, v_voi = rs_plan.apply(m_mag, m_real, m_imag, v_voi)
+        v_voi  = v_voi > 0.5
         v_f0   = shift_to_f0(v_shift, v_voi, fs, out='f0', b_smooth=False)
         nfrms  = v_shift.size
 
@@ -1168,9 +1469,9 @@ def synthesis_from_compressed_type1_with_phase_comp(m_mag_mel_log, m_real_mel, m
     # Window anti-ringing:
     frmlen = m_syn_frms.shape[1]
     v_shift_ext = np.r_[v_shift[0], v_shift, v_shift[-1], v_shift[-1]] # recover first shift (estimate)
-    for nxf in xrange(nfrms):
-        v_win = la.gen_centr_win(v_shift_ext[nxf]+v_shift_ext[nxf+1], v_shift_ext[nxf+2]+v_shift_ext[nxf+3], frmlen, win_func=raised_hanning, b_fill_w_bound_val=True)
-        m_syn_frms[nxf,:] *= v_win
+    m_win, v_nx_win = la.centr_win_bank(v_shift_ext[:nfrms]+v_shift_ext[1:(nfrms+1)], v_shift_ext[2:(nfrms+2)]+v_shift_ext[3:(nfrms+3)],
+                                                            frmlen, win_func=raised_hanning, b_fill_w_bound_val=True)
+    m_syn_frms *= m_win[v_nx_win,:]
 
 
     if False:
@@ -1301,10 +1602,9 @@ def synthesis_from_compressed_type1(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0
         const_rate_ms = 5.0
         interp_type = 'linear' #'quadratic' , 'cubic'
         v_shift, v_frm_locs_smpls = get_shifts_and_frm_locs_from_const_shifts(v_shift, const_rate_ms, fs, interp_type=interp_type)
-        m_mag  = interp_from_const_to_variable_rate(m_mag,  v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_real = interp_from_const_to_variable_rate(m_real, v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_imag = interp_from_const_to_variable_rate(m_imag, v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type)
-        v_voi  = interp_from_const_to_variable_rate(v_voi,  v_frm_locs_smpls, const_rate_ms, fs, interp_type=interp_type) > 0.5
+        rs_plan = plan_const_to_variable_rate(np.size(m_mag,0), v_frm_locs_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag, v_voi = rs_plan.apply(m_mag, m_real, m_imag, v_voi)
+        v_voi  = v_voi > 0.5
         v_f0   = shift_to_f0(v_shift, v_voi, fs, out='f0', b_smooth=False)
         nfrms  = v_shift.size
 
@@ -1424,28 +1724,50 @@ def synthesis_from_compressed_type1(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0
 # NOTE: "v_frm_locs_smpls" are the locations of the target frames (centres) in the constant rate data to sample from.
 # This function should be used along with the function "interp_from_const_to_variable_rate"
 def get_shifts_and_frm_locs_from_const_shifts(v_shift_c_rate, frm_rate_ms, fs, interp_type='linear'):
-
+    '''
+    Epoch placement for constant frame rate features: starting at the last constant rate frame, each epoch is placed one
+    (interpolated) shift before the next one, until the first constant rate frame is reached.
+    Returns v_shift_vr, v_frm_locs_smpls (exact length, crescent).
+    For interp_type='linear', the interpolation segments (slopes) are precomputed, and the current segment is tracked as the
+    epochs go backwards (no interp1d per epoch). The result is the same as for interp1d.
+    '''
     # Interpolation in reverse:
     n_c_rate_frms      = np.size(v_shift_c_rate,0)
     frm_rate_smpls     = fs * frm_rate_ms / 1000
 
     v_c_rate_centrs_smpls = frm_rate_smpls * np.arange(1,n_c_rate_frms+1)
-    f_interp   = interpolate.interp1d(v_c_rate_centrs_smpls, v_shift_c_rate, axis=0, kind=interp_type)
-    v_shift_vr = np.zeros(n_c_rate_frms * 2) # * 2 just in case, Improve these!
-    v_frm_locs_smpls = np.zeros(n_c_rate_frms * 2)
-    curr_pos_smpl = v_c_rate_centrs_smpls[-1]
-    for i_vr in xrange(len(v_shift_vr)-1,0, -1):
-        #print(i_vr)
-        v_frm_locs_smpls[i_vr] = curr_pos_smpl
-        try:
-            v_shift_vr[i_vr] = f_interp(curr_pos_smpl)
-        except ValueError:
-            v_frm_locs_smpls = v_frm_locs_smpls[i_vr+1:]
-            v_shift_vr  = v_shift_vr[i_vr+1:]
-            break
-
-        curr_pos_smpl = curr_pos_smpl - v_shift_vr[i_vr]
+    if n_c_rate_frms < 2:
+        raise ValueError('x and y arrays must have at least 2 entries')
+    if np.any(v_shift_c_rate <= 0):
+        raise ValueError('Shifts should be positive.')
 
+    l_shift_vr    = []
+    l_frm_locs    = []
+    curr_pos_smpl = v_c_rate_centrs_smpls[-1]
+    first_pos     = v_c_rate_centrs_smpls[0]
+    if interp_type=='linear':
+        # Segments (as interp1d: for x in (x[hi-1], x[hi]], y = slope[hi-1] * (x - x[hi-1]) + y[hi-1]):
+        l_x     = v_c_rate_centrs_smpls.tolist()
+        l_y     = v_shift_c_rate.tolist()
+        l_slope = ((v_shift_c_rate[1:] - v_shift_c_rate[:-1]) / (v_c_rate_centrs_smpls[1:] - v_c_rate_centrs_smpls[:-1])).tolist()
+        nx_hi   = n_c_rate_frms - 1
+        while curr_pos_smpl >= first_pos:
+            while (nx_hi > 1) and (l_x[nx_hi-1] >= curr_pos_smpl):
+                nx_hi -= 1
+            shift = l_slope[nx_hi-1] * (curr_pos_smpl - l_x[nx_hi-1]) + l_y[nx_hi-1]
+            l_frm_locs.append(curr_pos_smpl)
+            l_shift_vr.append(shift)
+            curr_pos_smpl = curr_pos_smpl - shift
+    else:
+        f_interp = interpolate.interp1d(v_c_rate_centrs_smpls, v_shift_c_rate, axis=0, kind=interp_type)
+        while curr_pos_smpl >= first_pos:
+            shift = float(f_interp(curr_pos_smpl))
+            l_frm_locs.append(curr_pos_smpl)
+            l_shift_vr.append(shift)
+            curr_pos_smpl = curr_pos_smpl - shift
+
+    v_shift_vr       = np.array(l_shift_vr[::-1])
+    v_frm_locs_smpls = np.array(l_frm_locs[::-1], dtype='float64')
     return v_shift_vr, v_frm_locs_smpls
 
 
@@ -1505,10 +1827,9 @@ def synthesis_from_compressed_type2(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0
     if const_rate_ms>0.0:
         #v_shift = f0_to_shift(v_f0, fs)
         v_shift, v_frm_locs_smpls = get_shifts_and_frm_locs_from_const_shifts(v_shift, const_rate_ms, fs, interp_type='linear')
-        m_mag  = interp_from_const_to_variable_rate(m_mag, v_frm_locs_smpls, const_rate_ms, fs, interp_type='linear')
-        m_real = interp_from_const_to_variable_rate(m_real, v_frm_locs_smpls, const_rate_ms, fs, interp_type='linear')
-        m_imag = interp_from_const_to_variable_rate(m_imag, v_frm_locs_smpls, const_rate_ms, fs, interp_type='linear')
-        v_voi  = interp_from_const_to_variable_rate(v_f0>0.0, v_frm_locs_smpls, const_rate_ms, fs, interp_type='linear') > 0.5
+        rs_plan = plan_const_to_variable_rate(np.size(m_mag,0), v_frm_locs_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag, v_voi = rs_plan.apply(m_mag, m_real, m_imag, v_f0>0.0)
+        v_voi  = v_voi > 0.5
         v_f0   = shift_to_f0(v_shift, v_voi, fs, out='f0', b_smooth=False)
         nfrms  = v_shift.size
 
@@ -1571,9 +1892,9 @@ def synthesis_from_compressed_type2(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0
     # Apply window anti-ringing:----------------------------------------------------
     frmlen = m_syn_td.shape[1]
     v_shift_ext = np.r_[v_shift[0], v_shift, v_shift[-1], v_shift[-1]] # recover first shift (estimate)
-    for nxf in xrange(nfrms):
-        v_win = la.gen_centr_win(v_shift_ext[nxf]+v_shift_ext[nxf+1], v_shift_ext[nxf+2]+v_shift_ext[nxf+3], frmlen, win_func=raised_hanning, b_fill_w_bound_val=True)
-        m_syn_td[nxf,:] *= v_win
+    m_win, v_nx_win = la.centr_win_bank(v_shift_ext[:nfrms]+v_shift_ext[1:(nfrms+1)], v_shift_ext[2:(nfrms+2)]+v_shift_ext[3:(nfrms+3)],
+                                                            frmlen, win_func=raised_hanning, b_fill_w_bound_val=True)
+    m_syn_td *= m_win[v_nx_win,:]
 
     # Apply gain:
     '''
@@ -1765,8 +2086,7 @@ def synthesis_from_lossless(m_mag, m_real, m_imag, v_f0, fs):
     m_ph_cmpx_mag[m_ph_cmpx_mag==0.0] = 1.0
     m_fft     = m_mag * m_ph_cmpx / m_ph_cmpx_mag
     
-    m_fft     = la.add_hermitian_half(m_fft, data_type='complex')
-    m_frm     = np.fft.ifft(m_fft).real
+    m_frm     = la.irfft_frames(m_fft)
     m_frm     = np.fft.fftshift(m_frm,  axes=1)
     v_shift   = f0_to_shift(v_f0, fs, unv_frm_rate_ms=5)
     v_pm      = la.shift_to_pm(v_shift)
@@ -2043,6 +2363,53 @@ def to_constant_rate(m_data, targ_shift_ms, v_shift, fs, interp_kind='linear'):
     
     return m_data
    
+#==============================================================================
+# Label/frame alignment:
+# Epochs and label boundaries are both sorted in time, so they are aligned by binary search (np.searchsorted),
+# instead of comparing every label line with every frame.
+# m_labs_times: label start and end times (columns 0 and 1 of HTS label files, in units of 100 ns).
+
+def get_num_of_frms_per_lab_line(v_shift, m_labs_times, fs):
+    '''
+    Number of frames whose epoch (from v_shift, in samples) lies inside each label line: start <= epoch < end.
+    '''
+    v_ep_nxs_ms = np.cumsum(v_shift) * 1000.0 / fs
+    m_labs_ms   = m_labs_times / 10000.0
+    v_nfrms = np.searchsorted(v_ep_nxs_ms, m_labs_ms[:,1], side='left') - np.searchsorted(v_ep_nxs_ms, m_labs_ms[:,0], side='left')
+    return np.maximum(v_nfrms, 0).astype('float64')
+
+def get_lab_line_nx_per_frm(v_pm_ms, v_labs_start_ms):
+    '''
+    Index of the label line of each frame (i.e., the last line that starts before or at the frame).
+    '''
+    v_line_nx = np.searchsorted(v_labs_start_ms, v_pm_ms, side='right') - 1
+    if np.any(v_line_nx < 0):
+        raise ValueError('There are frames before the start of the first label.')
+    return v_line_nx
+
+def check_num_of_frms_per_lab_line(v_nfrms_x_line, nfrms, n_lines_x_unit=5, nfrms_tolerance=1):
+    '''
+    Corrects small differences at the end of the label file (see nfrms_tolerance), and checks the number of frames.
+    Returns the (corrected) number of frames per line and per unit (e.g., phoneme).
+    '''
+    # Correct if there is only one frame of difference:
+    nfrms_diff = nfrms - np.sum(v_nfrms_x_line)
+    if (nfrms_diff > 0) and (nfrms_diff <= nfrms_tolerance):
+        v_nfrms_x_line[-1] += nfrms_diff
+
+    # Checking number of frames:
+    if np.sum(v_nfrms_x_line) != nfrms:
+        raise ValueError('Total number of frames is different to the number of frames of the shifts.')
+
+    m_nfrms_x_unit = np.reshape(v_nfrms_x_line, (v_nfrms_x_line.size/n_lines_x_unit, n_lines_x_unit))
+    v_nfrms_x_unit = np.sum(m_nfrms_x_unit, axis=1)
+
+    # Checking that the number of frames per phoneme should be greater than 0:
+    if any(v_nfrms_x_unit == 0.0):
+        raise ValueError('There is some phoneme(s) that do(es) not contain any frame.')
+
+    return v_nfrms_x_line, v_nfrms_x_unit
+
 #==============================================================================
 # v2: allows fine frame state position (adds relative position within the state as decimal number).
 # shift file in samples
@@ -2050,25 +2417,20 @@ def frame_to_state_mapping2(shift_file, state_lab_file, fs, states_per_phone=5,
     #Read files:
     v_shift = lu.read_binfile(shift_file, dim=1)
     v_pm = la.shift_to_pm(v_shift)
-    m_state_times = np.loadtxt(state_lab_file, usecols=(0,1))    
+    m_state_times = la.read_lab_file(state_lab_file)[0]    
     
     # to miliseconds:
     v_pm_ms = 1000 * v_pm / fs
     m_state_times_ms = m_state_times / 10000.0    
     
     # Compare:
-    nfrms = len(v_pm_ms)
-    v_st = np.zeros(nfrms) - 1 # init
-    for f in xrange(nfrms):
-        vb_greater = (v_pm_ms[f] >= m_state_times_ms[:,0])  # * (v_pm_ms[f] <  m_state_times_ms[:,1])
-        state_nx   = np.where(vb_greater)[0][-1]
-        v_st[f]    = np.remainder(state_nx, states_per_phone)
-
-        # Refining:
-        if b_refine:
-            state_len_ms = m_state_times_ms[state_nx,1] - m_state_times_ms[state_nx,0]
-            fine_pos = ( v_pm_ms[f] - m_state_times_ms[state_nx,0] ) / state_len_ms
-            v_st[f] += fine_pos 
+    v_state_nx = get_lab_line_nx_per_frm(v_pm_ms, m_state_times_ms[:,0])
+    v_st = np.remainder(v_state_nx, states_per_phone).astype('float64')
+
+    # Refining:
+    if b_refine:
+        v_state_len_ms = m_state_times_ms[v_state_nx,1] - m_state_times_ms[v_state_nx,0]
+        v_st += ( v_pm_ms - m_state_times_ms[v_state_nx,0] ) / v_state_len_ms
             
     # Protection against wrong ended label files:
     np.clip(v_st, 0, states_per_phone, out=v_st)      
@@ -2081,19 +2443,14 @@ def frame_to_state_mapping(shift_file, lab_file, fs, states_per_phone=5):
     #Read files:
     v_shift = lu.read_binfile(shift_file, dim=1)
     v_pm = la.shift_to_pm(v_shift)
-    m_state_times = np.loadtxt(lab_file, usecols=(0,1))    
+    m_state_times = la.read_lab_file(lab_file)[0]    
     
     # to miliseconds:
     v_pm_ms = 1000 * v_pm / fs
     m_state_times_ms = m_state_times / 10000.0    
     
     # Compare:
-    nfrms = len(v_pm_ms)
-    v_st = np.zeros(nfrms) - 1 # init
-    for f in xrange(nfrms):
-        vb_greater = (v_pm_ms[f] >= m_state_times_ms[:,0])  # * (v_pm_ms[f] <  m_state_times_ms[:,1])
-        state_nx   = np.where(vb_greater)[0][-1]
-        v_st[f]    = np.remainder(state_nx, states_per_phone)
+    v_st = np.remainder(get_lab_line_nx_per_frm(v_pm_ms, m_state_times_ms[:,0]), states_per_phone).astype('float64')
     return v_st
     
 #==============================================================================
@@ -2111,43 +2468,55 @@ def get_n_frms_per_unit(v_shifts, in_lab_state_al_file, fs, unit_type='phone', n
 def get_num_of_frms_per_state(v_shift, lab_state_align_file, fs, b_prevent_zeros=False, n_states_x_phone=5, nfrms_tolerance=6):
 
     # Read lab file:
-    m_labs_state = np.loadtxt(lab_state_align_file, usecols=(0,1))
-    m_labs_state_ms = m_labs_state / 10000.0
-
-    # Epoch Indexes:
-    v_ep_nxs = np.cumsum(v_shift)
-    v_ep_nxs_ms = v_ep_nxs * 1000.0 / fs
+    m_labs_state = la.read_lab_file(lab_state_align_file)[0]
 
     # Get number of frames per state:
-    n_states        = np.size(m_labs_state_ms,axis=0)
-    v_nfrms_x_state = np.zeros(n_states)
+    v_nfrms_x_state = get_num_of_frms_per_lab_line(v_shift, m_labs_state, fs)
+    v_nfrms_x_state = check_num_of_frms_per_lab_line(v_nfrms_x_state, np.size(v_shift), n_lines_x_unit=n_states_x_phone, nfrms_tolerance=nfrms_tolerance)[0]
 
-    for st in xrange(n_states):
-        vb_to_right = (m_labs_state_ms[st,0] <= v_ep_nxs_ms)
-        vb_to_left  = (v_ep_nxs_ms < m_labs_state_ms[st,1])
-        vb_inter    = vb_to_right * vb_to_left
-        v_nfrms_x_state[st] = sum(vb_inter)
+    # Preventing zeros:
+    if b_prevent_zeros:
+        v_nfrms_x_state[v_nfrms_x_state==0] = 1
 
-    # Correct if there is only one frame of difference:
-    nfrms_diff = np.size(v_shift) - np.sum(v_nfrms_x_state)
-    if (nfrms_diff > 0) and (nfrms_diff <= nfrms_tolerance):
-        v_nfrms_x_state[-1] += nfrms_diff
+    return v_nfrms_x_state
 
-    # Checking number of frames:
-    if np.sum(v_nfrms_x_state) != np.size(v_shift):
-        raise ValueError('Total number of frames is different to the number of frames of the shifts.')
-    m_nfrms_x_ph  = np.reshape(v_nfrms_x_state, (n_states/n_states_x_phone, n_states_x_phone))
-    v_nfrms_x_ph  = np.sum(m_nfrms_x_ph, axis=1)
+def get_num_of_frms_per_state_batch(l_shift_files, l_lab_state_align_files, fs, b_prevent_zeros=False, n_states_x_phone=5, nfrms_tolerance=6):
+    '''
+    Batch version of get_num_of_frms_per_state, for lists of .shift files and state aligned label files (in the same order).
+    A file that fails does not stop the batch.
+    Returns:
+    - l_v_nfrms_x_state: Number of frames per state for each file (None if it failed).
+    - d_errors: {file index: error message}.
+    '''
+    l_v_nfrms_x_state = []
+    d_errors = {}
+    for nxf in xrange(len(l_lab_state_align_files)):
+        try:
+            v_shift = lu.read_binfile(l_shift_files[nxf], dim=1)
+            l_v_nfrms_x_state.append(get_num_of_frms_per_state(v_shift, l_lab_state_align_files[nxf], fs, b_prevent_zeros=b_prevent_zeros,
+                                                               n_states_x_phone=n_states_x_phone, nfrms_tolerance=nfrms_tolerance))
+        except (IOError, ValueError, IndexError) as e:
+            l_v_nfrms_x_state.append(None)
+            d_errors[nxf] = '%s: %s' % (type(e).__name__, e)
 
-    # Checking that the number of frames per phoneme should be greater than 0:
-    if any(v_nfrms_x_ph == 0.0):
-        raise ValueError('There is some phoneme(s) that do(es) not contain any frame.')
+    return l_v_nfrms_x_state, d_errors
 
-    # Preventing zeros:
+def convert_label_state_align_to_var_frame_rate(in_lab_st_file, in_shift_file, out_lab_st_file, fs, b_prevent_zeros=False, n_states_x_phone=5, nfrms_tolerance=6):
+    '''
+    Converts a state aligned label file to the "variable frame rate" label file used by Merlin (see la.convert_label_state_align_to_var_frame_rate),
+    from the shifts extracted by the analysis (.shift file). Each file is read once.
+    Returns the total number of frames.
+    '''
+    v_shift = lu.read_binfile(in_shift_file, dim=1)
+    m_labs_times, l_labs = la.read_lab_file(in_lab_st_file)
+
+    v_nfrms_x_state = get_num_of_frms_per_lab_line(v_shift, m_labs_times, fs)
+    v_nfrms_x_state = check_num_of_frms_per_lab_line(v_nfrms_x_state, np.size(v_shift), n_lines_x_unit=n_states_x_phone, nfrms_tolerance=nfrms_tolerance)[0]
     if b_prevent_zeros:
         v_nfrms_x_state[v_nfrms_x_state==0] = 1
 
-    return v_nfrms_x_state
+    la.write_lab_file(out_lab_st_file, la.var_frame_rate_lab_times(v_nfrms_x_state), l_labs)
+    return int(np.sum(v_nfrms_x_state))
     
 #==============================================================================
 # in_lab_aligned_file: in HTS format
@@ -2158,38 +2527,11 @@ def get_num_of_frms_per_state(v_shift, lab_state_align_file, fs, b_prevent_zeros
 def get_num_of_frms_per_phon_unit(v_shift, in_lab_aligned_file, fs, n_lines_x_unit=5, nfrms_tolerance=1):   
 
     # Read lab file:
-    m_labs_state = np.loadtxt(in_lab_aligned_file, usecols=(0,1))
-    m_labs_state_ms = m_labs_state / 10000.0
-    
-    # Epoch Indexes:
-    v_ep_nxs = np.cumsum(v_shift)
-    v_ep_nxs_ms = v_ep_nxs * 1000.0 / fs
-    
-    # Get number of frames per state:
-    n_states        = np.size(m_labs_state_ms,axis=0)
-    v_nfrms_x_state = np.zeros(n_states)    
-    
-    for st in xrange(n_states):
-        vb_to_right = (m_labs_state_ms[st,0] <= v_ep_nxs_ms)
-        vb_to_left  = (v_ep_nxs_ms < m_labs_state_ms[st,1])        
-        vb_inter    = vb_to_right * vb_to_left        
-        v_nfrms_x_state[st] = sum(vb_inter) 
-        
-    # Correct if there is only one frame of difference:  
-    nfrms_diff = np.size(v_shift) - np.sum(v_nfrms_x_state)     
-    if (nfrms_diff > 0) and (nfrms_diff <= nfrms_tolerance):
-        v_nfrms_x_state[-1] += nfrms_diff 
-        
-    # Checking number of frames:  
-    if np.sum(v_nfrms_x_state) != np.size(v_shift):
-        raise ValueError('Total number of frames is different to the number of frames of the shifts.')
+    m_labs_state = la.read_lab_file(in_lab_aligned_file)[0]
 
-    m_nfrms_x_ph  = np.reshape(v_nfrms_x_state, (n_states/n_lines_x_unit, n_lines_x_unit) )
-    v_nfrms_x_ph  = np.sum(m_nfrms_x_ph, axis=1)
-            
-    # Checking that the number of frames per phoneme should be greater than 0:
-    if any(v_nfrms_x_ph == 0.0):
-        raise ValueError('There is some phoneme(s) that do(es) not contain any frame.') 
+    # Get number of frames per state (line) and per unit:
+    v_nfrms_x_state = get_num_of_frms_per_lab_line(v_shift, m_labs_state, fs)
+    v_nfrms_x_ph    = check_num_of_frms_per_lab_line(v_nfrms_x_state, np.size(v_shift), n_lines_x_unit=n_lines_x_unit, nfrms_tolerance=nfrms_tolerance)[1]
         
     return v_nfrms_x_ph
     
@@ -2215,9 +2557,85 @@ def f0_to_shift(v_f0_in, fs, unv_frm_rate_ms=5):
     return v_shift     
 
 
+#==============================================================================
+class ResamplingPlan(object):
+    '''
+    Precomputed linear interpolation between two frame grids (e.g., from variable to constant frame rate, and back).
+    The gather indexes and interpolation weights are computed once (e.g., per utterance), and applied to any number of
+    streams on the same grid (e.g., mag, real, imag, and voicing) by fancy indexing and blending (see apply).
+    Same result as interpolate.interp1d(..., kind='linear'). Single precision data is kept in single precision.
+    v_in_locs:  Locations of the input frames (e.g., in samples). Crescent.
+    v_out_locs: Locations of the output frames. They should be within the range of v_in_locs.
+    v_in_rows:  Optional. Row of the input data for each location in v_in_locs (e.g., to repeat the first frame).
+                If None, one row per location.
+    '''
+    def __init__(self, v_in_locs, v_out_locs, v_in_rows=None):
+        v_in_locs  = np.asarray(v_in_locs , dtype='float64')
+        v_out_locs = np.asarray(v_out_locs, dtype='float64')
+        if v_in_rows is None:
+            v_in_rows = np.arange(v_in_locs.size)
+
+        if v_in_locs.size < 2:
+            raise ValueError('At least two input frames are needed for interpolation.')
+        if (v_out_locs.size > 0) and ((v_out_locs.min() < v_in_locs[0]) or (v_out_locs.max() > v_in_locs[-1])):
+            raise ValueError('Output frame locations out of the range of the input frame locations.')
+
+        # Neighbours and weights (as interp1d):
+        v_nx_hi = np.clip(np.searchsorted(v_in_locs, v_out_locs, side='left'), 1, v_in_locs.size-1)
+        v_nx_lo = v_nx_hi - 1
+        self.v_weight = (v_out_locs - v_in_locs[v_nx_lo]) / (v_in_locs[v_nx_hi] - v_in_locs[v_nx_lo])
+        self.v_nx_lo  = v_in_rows[v_nx_lo]
+        self.v_nx_hi  = v_in_rows[v_nx_hi]
+        self.nfrms_in = int(np.max(v_in_rows)) + 1
+        return
+
+    def apply(self, *l_data):
+        '''
+        Interpolates each stream (vector, or matrix with one frame per row). Non float data (e.g., boolean voicing) is converted to float.
+        Returns the interpolated stream, or a tuple of them if several streams are given.
+        '''
+        l_out = []
+        for m_data in l_data:
+            m_data = np.asarray(m_data)
+            if not np.issubdtype(m_data.dtype, np.inexact):
+                m_data = m_data.astype('float64')
+            if m_data.shape[0] != self.nfrms_in:
+                raise ValueError('Number of input frames (%d) different than expected by the plan (%d).' % (m_data.shape[0], self.nfrms_in))
+
+            v_weight = self.v_weight.astype(m_data.real.dtype, copy=False).reshape((-1,) + (1,) * (m_data.ndim - 1))
+            m_lo = m_data[self.v_nx_lo]
+            l_out.append(m_lo + v_weight * (m_data[self.v_nx_hi] - m_lo))
+
+        return l_out[0] if (len(l_out)==1) else tuple(l_out)
+
+def plan_var_to_const_frm_rate(v_pm_smpls, const_rate_ms, fs):
+    '''
+    ResamplingPlan from the pitch marks (frame locations in samples) to constant frame rate (see interp_from_variable_to_const_frm_rate).
+    '''
+    dur_total_smpls  = v_pm_smpls[-1]
+    const_rate_smpls = fs * const_rate_ms / 1000
+    v_c_rate_centrs_smpls = np.arange(const_rate_smpls, dur_total_smpls, const_rate_smpls)
+
+    if v_pm_smpls[0]>0: # Protection (first frame repeated at 0)
+        return ResamplingPlan(np.r_[0, v_pm_smpls], v_c_rate_centrs_smpls, v_in_rows=np.r_[0, np.arange(len(v_pm_smpls))])
+    return ResamplingPlan(v_pm_smpls, v_c_rate_centrs_smpls)
+
+def plan_const_to_variable_rate(n_c_rate_frms, v_frm_locs_smpls, frm_rate_ms, fs):
+    '''
+    ResamplingPlan from constant frame rate to the frame locations v_frm_locs_smpls (see interp_from_const_to_variable_rate).
+    '''
+    frm_rate_smpls = fs * frm_rate_ms / 1000
+    v_c_rate_centrs_smpls = frm_rate_smpls * np.arange(1,n_c_rate_frms+1)
+    return ResamplingPlan(v_c_rate_centrs_smpls, v_frm_locs_smpls)
+
 #============================================================================== 
 def interp_from_variable_to_const_frm_rate(m_data, v_pm_smpls, const_rate_ms, fs, interp_type='linear'):
-    
+    '''
+    For several streams on the same grid, use plan_var_to_const_frm_rate(...).apply(...) instead.
+    '''
+    if interp_type=='linear':
+        return plan_var_to_const_frm_rate(v_pm_smpls, const_rate_ms, fs).apply(m_data)
+
     dp = lu.DimProtect(m_data)
 
     dur_total_smpls  = v_pm_smpls[-1]
@@ -2240,8 +2658,13 @@ def interp_from_variable_to_const_frm_rate(m_data, v_pm_smpls, const_rate_ms, fs
 
 #==============================================================================
 def interp_from_const_to_variable_rate(m_data, v_frm_locs_smpls, frm_rate_ms, fs, interp_type='linear'):
-
+    '''
+    For several streams on the same grid, use plan_const_to_variable_rate(...).apply(...) instead.
+    '''
     n_c_rate_frms  = np.size(m_data,0)                
+    if interp_type=='linear':
+        return plan_const_to_variable_rate(n_c_rate_frms, v_frm_locs_smpls, frm_rate_ms, fs).apply(m_data)
+
     frm_rate_smpls = fs * frm_rate_ms / 1000
     
     v_c_rate_centrs_smpls = frm_rate_smpls * np.arange(1,n_c_rate_frms+1)
@@ -2339,43 +2762,44 @@ def post_filter(m_mag_mel_log, fs, av_len_at_zero=None, av_len_at_nyq=None, boos
                 '\nProvide your own values for the options: av_len_at_zero, av_len_at_nyq, boost_at_zero,' + \
                 '\nboost_at_nyq if you use another sample rate')
 
-    # Body:
-    v_ave  = np.zeros(mag_dim)
-    v_nx   = np.arange(np.floor(av_len_at_zero/2), mag_dim - np.floor(av_len_at_nyq/2)).astype(int)
-    v_lens = np.linspace(av_len_at_zero, av_len_at_nyq, v_nx.size)
-    v_lens = (2*np.ceil(v_lens/2) - 1).astype(int)
-
-    m_mag_mel_log_enh = np.zeros(m_mag_mel_log.shape)
-    for nxf in xrange(nfrms):
+    # Body (all frames at once. The filter matrix is cached):
+    key  = ('post_filter', mag_dim, av_len_at_zero, av_len_at_nyq, boost_at_zero, boost_at_nyq)
+    m_pf = la.get_cached_transform(key, post_filter_matrix, mag_dim, av_len_at_zero, av_len_at_nyq, boost_at_zero, boost_at_nyq)
 
-        v_mag_mel_log = m_mag_mel_log[nxf,:]
+    m_mag_mel_log_enh = np.dot(m_mag_mel_log, m_pf.astype(m_mag_mel_log.dtype, copy=False)) # keeps the input precision (e.g., float32)
 
-        # Average:
-        for nxb in v_nx:
-            halflen    = np.floor(v_lens[nxb-v_nx[0]]/2).astype(int)
-            v_ave[nxb] = np.mean(v_mag_mel_log[(nxb-halflen):(nxb+halflen+1)])
+    return m_mag_mel_log_enh
 
-        # Fixing boundaries:
-        v_ave[:v_nx[0]]  = v_ave[v_nx[0]]
-        v_ave[v_nx[-1]:] = v_ave[v_nx[-1]]
+def post_filter_matrix(mag_dim, av_len_at_zero, av_len_at_nyq, boost_at_zero, boost_at_nyq):
+    '''
+    Matrix form of post_filter (mag_dim x mag_dim), such that: m_mag_mel_log_enh = np.dot(m_mag_mel_log, m_pf)
+    Per frame, post_filter substracts a moving average (variable length along the bins), boosts the difference by a
+    tilted factor, and adds the average back. The first and last bins are kept. All of these are linear.
+    '''
+    # Averaging matrix (row nxb: weights of the average at bin nxb):
+    v_nx   = np.arange(np.floor(av_len_at_zero/2), mag_dim - np.floor(av_len_at_nyq/2)).astype(int)
+    v_lens = np.linspace(av_len_at_zero, av_len_at_nyq, v_nx.size)
+    v_lens = (2*np.ceil(v_lens/2) - 1).astype(int)
 
-        # Substracting average:
-        v_mag_mel_log_norm = v_mag_mel_log - v_ave
+    m_in_win = np.abs(np.arange(mag_dim)[None,:] - v_nx[:,None]) <= (v_lens[:,None] / 2)
+    m_ave    = np.zeros((mag_dim, mag_dim))
+    m_ave[v_nx,:] = m_in_win / np.sum(m_in_win, axis=1)[:,None].astype(float) # averages truncated at the edges (if any)
 
-        # Debug:
-        if False:
-            from libplot import lp; lp.figure(); lp.plot(v_mag_mel_log); lp.plot(v_ave); lp.plot(v_mag_mel_log_norm); lp.grid(); lp.show()
+    # Fixing boundaries:
+    m_ave[:v_nx[0],:]  = m_ave[v_nx[0],:]
+    m_ave[v_nx[-1]:,:] = m_ave[v_nx[-1],:]
 
-        # Enhance:
-        v_tilt_fact = np.linspace(boost_at_zero, boost_at_nyq, mag_dim)
-        v_mag_mel_log_enh = (v_mag_mel_log_norm * v_tilt_fact) + v_ave
-        v_mag_mel_log_enh[0]  = v_mag_mel_log[0]
-        v_mag_mel_log_enh[-1] = v_mag_mel_log[-1]
+    # Enhance: (v_mag_mel_log - v_ave) * v_tilt_fact + v_ave
+    v_tilt_fact = np.linspace(boost_at_zero, boost_at_nyq, mag_dim)
+    m_pf = np.diag(v_tilt_fact) + m_ave.T * (1.0 - v_tilt_fact)[None,:]
 
-        # Saving:
-        m_mag_mel_log_enh[nxf,:] = v_mag_mel_log_enh
+    # Keeping first and last bins:
+    m_pf[:,0]  = 0.0
+    m_pf[:,-1] = 0.0
+    m_pf[0,0]   = 1.0
+    m_pf[-1,-1] = 1.0
 
-    return m_mag_mel_log_enh
+    return m_pf
 
 
 
@@ -2589,8 +3013,9 @@ def format_for_modelling_phase_comp(m_mag, m_real, m_imag, v_f0, fs, mag_dim=60,
     m_real_shrt = m_real[:,:max_bin_ph]
     m_imag_shrt = m_imag[:,:max_bin_ph]
     #--------------------------------------------------------------------------------
-    m_real_mel = la.apply_fbank(m_real_shrt, v_bins_mel, phase_dim)[0]
-    m_imag_mel = la.apply_fbank(m_imag_shrt, v_bins_mel, phase_dim)[0]
+    fbank = la.get_mel_fbank(max_bin_ph, phase_dim, alpha=alpha, nbins_full=fft_len_half)
+    m_real_mel = fbank.warp(m_real_shrt)
+    m_imag_mel = fbank.warp(m_imag_shrt)
 
 
     # Debug (phase ratio):
@@ -2790,16 +3215,79 @@ def write_featfile(m_data, out_dir, filename):
     lu.write_binfile(m_data, filepath)
     return
 
-def analysis_lossless_type2(wav_file, fft_len=None, out_dir=None):
+# Feature store (one file per corpus instead of one file per feature and utterance. See lu.FeatStore):------------------
+def write_feats_to_store(store, file_id, m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs, fft_len, v_shift=None):
+    '''
+    Adds the compressed features of an utterance to a feature store (lu.FeatStore opened in 'w' or 'a' mode).
+    v_shift: Shifts (variable frame rate). None for constant frame rate features.
+    '''
+    l_streams = [('mag', m_mag_mel_log), ('real', m_real_mel), ('imag', m_imag_mel), ('lf0', v_lf0)]
+    if v_shift is not None:
+        l_streams.append(('shift', v_shift))
+
+    d_attrs = { 'nfrms'       : int(np.size(v_lf0)),
+                'mag_dim'     : int(np.size(m_mag_mel_log,1)),
+                'phase_dim'   : int(np.size(m_real_mel,1)),
+                'fs'          : int(fs),
+                'fft_len'     : int(fft_len),
+                'b_const_rate': v_shift is None }
+
+    store.put(file_id, l_streams, d_attrs=d_attrs)
+    return
+
+def read_feats_from_store(store, file_id, dtype='float64'):
+    '''
+    Returns m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, and the attributes of the utterance (nfrms, mag_dim, phase_dim,
+    fs, fft_len, b_const_rate).
+    dtype: 'float64' (as lu.read_binfile), or 'float32' (no copy. Read-only views if the store is memory-mapped).
+    '''
+    m_mag_mel_log = store.get(file_id, 'mag' ).astype(dtype, copy=False)
+    m_real_mel    = store.get(file_id, 'real').astype(dtype, copy=False)
+    m_imag_mel    = store.get(file_id, 'imag').astype(dtype, copy=False)
+    v_lf0         = store.get(file_id, 'lf0' ).astype(dtype, copy=False)
+    return m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, store.get_attrs(file_id)
+
+def import_featfiles_to_store(in_feats_dir, l_file_tokns, store_file, mag_dim, phase_dim, fs, fft_len=None, b_const_rate=False):
+    '''
+    Packs Merlin-style feature files (.mag, .real, .imag, .lf0, and .shift if variable rate) into a feature store file.
+    If the store file exists, the utterances are appended.
+    '''
+    if fft_len is None:
+        fft_len = define_fft_len(fs)
+
+    with lu.FeatStore(store_file, mode='a') as store:
+        for file_tokn in l_file_tokns:
+            filepath = os.path.join(in_feats_dir, file_tokn)
+            v_shift  = None if b_const_rate else lu.read_binfile(filepath + '.shift', dim=1)
+            write_feats_to_store(store, file_tokn, lu.read_binfile(filepath + '.mag' , dim=mag_dim),
+                                                   lu.read_binfile(filepath + '.real', dim=phase_dim),
+                                                   lu.read_binfile(filepath + '.imag', dim=phase_dim),
+                                                   lu.read_binfile(filepath + '.lf0' , dim=1), fs, fft_len, v_shift=v_shift)
+    return
+
+def export_store_to_featfiles(store_file, out_dir, l_file_tokns=None):
+    '''
+    Unpacks a feature store file into Merlin-style feature files (<file>.mag, <file>.real, etc.).
+    l_file_tokns: Utterances to export. If None, all of them.
+    '''
+    with lu.FeatStore(store_file) as store:
+        if l_file_tokns is None:
+            l_file_tokns = store.keys()
+        for file_tokn in l_file_tokns:
+            for name, shape in store.get_streams(file_tokn):
+                write_featfile(store.get(file_tokn, name), out_dir, file_tokn + '.' + name)
+    return
+
+def analysis_lossless_type2(wav_file, fft_len=None, out_dir=None, epoch_detector=None):
+    '''
+    epoch_detector: 'reaper', 'native', or None (default set in config.ini). See la.get_epochs.
+    '''
 
     # Read file:
     v_sig, fs = sf.read(wav_file)
 
     # Epoch detection:
-    est_file = lu.ins_pid('temp.est')
-    la.reaper(wav_file, est_file)
-    v_pm_sec, v_voi = la.read_reaper_est_file(est_file, check_len_smpls=len(v_sig), fs=fs)
-    os.remove(est_file)
+    v_pm_sec, v_voi = la.get_epochs(v_sig, fs, wav_file=wav_file, detector=epoch_detector)
     v_pm_smpls = v_pm_sec * fs
 
     # Magnitude analysis:----------------------------------------------------------------
@@ -2866,16 +3354,16 @@ def analysis_lossless_type2(wav_file, fft_len=None, out_dir=None):
     return m_mag_env, m_real, m_imag, v_f0, fs, v_shift, v_gain
 
 
-def analysis_lossless(wav_file, fft_len=None, out_dir=None):
+def analysis_lossless(wav_file, fft_len=None, out_dir=None, epoch_detector=None):
+    '''
+    epoch_detector: 'reaper', 'native', or None (default set in config.ini). See la.get_epochs.
+    '''
 
     # Read file:
     v_sig, fs = sf.read(wav_file)
 
     # Epoch detection:
-    est_file = lu.ins_pid('temp.est')
-    la.reaper(wav_file, est_file)
-    v_pm_sec, v_voi = la.read_reaper_est_file(est_file, check_len_smpls=len(v_sig), fs=fs)
-    os.remove(est_file)
+    v_pm_sec, v_voi = la.get_epochs(v_sig, fs, wav_file=wav_file, detector=epoch_detector)
     v_pm_smpls = v_pm_sec * fs
 
     # Debug:
@@ -2905,6 +3393,73 @@ def analysis_lossless(wav_file, fft_len=None, out_dir=None):
 
     return m_mag, m_real, m_imag, v_f0, fs, v_shift
 
+def analysis_lossless_stream(wav_file, fft_len=None, block_len_sec=10.0, epoch_detector=None):
+    '''
+    Block streaming version of analysis_lossless for long recordings (e.g., audiobooks), in bounded memory.
+    It is a generator. It yields (m_mag, m_real, m_imag, v_f0, fs, v_shift) for consecutive blocks of frames.
+    Concatenated, the blocks are identical to the output of analysis_lossless.
+    block_len_sec:  Approximate duration of each block (in seconds).
+    epoch_detector: 'reaper', 'native', or None (default set in config.ini). See la.get_epochs.
+    NOTE: Epochs are detected on the whole file first (the output must not depend on the block boundaries).
+    REAPER works on the file directly, so the signal is not loaded. Other detectors need the whole signal in memory.
+    '''
+    if fft_len is None:
+        fft_len = define_fft_len(sf.info(wav_file).samplerate)
+
+    with sf.SoundFile(wav_file) as sfile:
+        fs      = sfile.samplerate
+        n_smpls = sfile.frames
+
+        # Epoch detection:
+        v_pm_sec, v_voi = la.get_epochs(None, fs, wav_file=wav_file, detector=epoch_detector)
+        v_pm_smpls = lu.round_to_int(v_pm_sec * fs)
+        v_pm_plus  = np.hstack((0, v_pm_smpls, (n_smpls-1))) # frame boundaries, as in windowing_to_matrix
+        nfrms      = len(v_pm_smpls)
+        block_len  = int(block_len_sec * fs)
+
+        # Signal buffer (overlap between blocks), and absolute position of its first sample:
+        v_buf   = np.zeros(0)
+        buf_pos = 0
+
+        nx_strt = 0
+        while nx_strt < nfrms:
+            # Frames in block (at least one):
+            nx_end = max(np.searchsorted(v_pm_smpls, v_pm_plus[nx_strt] + block_len, side='right'), nx_strt + 1)
+
+            # Samples in block (from the left boundary of the first frame to the right boundary of the last one):
+            seg_strt = v_pm_plus[nx_strt]
+            seg_end  = v_pm_plus[nx_end+1]
+            n_read   = seg_end + 1 - (buf_pos + len(v_buf))
+            if n_read > 0:
+                v_buf = np.hstack((v_buf, sfile.read(n_read)))
+            v_seg = v_buf[(seg_strt - buf_pos):(seg_end + 1 - buf_pos)]
+
+            # Spectral analysis:
+            m_fft, v_shift = analysis_with_del_comp_from_pm(v_seg, fs, v_pm_smpls[nx_strt:nx_end] - seg_strt, fft_len=fft_len)
+            m_mag, m_real, m_imag, v_f0 = compute_lossless_feats(m_fft, v_shift, v_voi[nx_strt:nx_end], fs)
+
+            yield m_mag, m_real, m_imag, v_f0, fs, v_shift
+
+            # Keep the overlap only:
+            v_buf   = v_buf[(v_pm_plus[nx_end] - buf_pos):]
+            buf_pos = v_pm_plus[nx_end]
+            nx_strt = nx_end
+
+def analysis_lossless_to_files(wav_file, out_dir, fft_len=None, block_len_sec=10.0, epoch_detector=None):
+    '''
+    Same as analysis_lossless(..., out_dir=out_dir), but using analysis_lossless_stream (bounded memory).
+    Features are written to disk block by block. Files are identical.
+    '''
+    file_id = os.path.basename(wav_file).split(".")[0]
+    l_exts  = ['.mag', '.real', '.imag', '.f0', '.shift']
+    b_append = False
+    for m_mag, m_real, m_imag, v_f0, fs, v_shift in analysis_lossless_stream(wav_file, fft_len=fft_len, block_len_sec=block_len_sec,
+                                                                                                epoch_detector=epoch_detector):
+        for data, ext in zip([m_mag, m_real, m_imag, v_f0, v_shift], l_exts):
+            lu.write_binfile(data, os.path.join(out_dir, file_id + ext), b_append=b_append)
+        b_append = True
+    return
+
 def analysis_compressed_type1(wav_file, fft_len=None, out_dir=None, mag_dim=60, phase_dim=45, const_rate_ms=-1.0):
 
     # Analysis:
@@ -2914,14 +3469,13 @@ def analysis_compressed_type1(wav_file, fft_len=None, out_dir=None, mag_dim=60,
     if const_rate_ms>0.0:
         interp_type = 'linear' #  'quadratic' # 'linear'
         v_pm_smpls = la.shift_to_pm(v_shift)
-        m_mag  = interp_from_variable_to_const_frm_rate(m_mag,  v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_real = interp_from_variable_to_const_frm_rate(m_real, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_imag = interp_from_variable_to_const_frm_rate(m_imag, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
+        rs_plan = plan_var_to_const_frm_rate(v_pm_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag = rs_plan.apply(m_mag, m_real, m_imag)
 
         # f0:
         v_voi = v_f0>1.0
         v_f0  = interp_from_variable_to_const_frm_rate(np.r_[ v_f0[v_voi][0],v_f0[v_voi], v_f0[v_voi][-1] ], np.r_[ 0, v_pm_smpls[v_voi], v_pm_smpls[-1] ], const_rate_ms, fs, interp_type=interp_type).squeeze()
-        v_voi = interp_from_variable_to_const_frm_rate(v_voi, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)>0.5
+        v_voi = rs_plan.apply(v_voi) > 0.5
         v_f0  *= v_voi # Double check this. At the beginning of voiced segments.
 
     # Formatting for Acoustic Modelling:
@@ -2945,7 +3499,7 @@ def analysis_compressed_type1(wav_file, fft_len=None, out_dir=None, mag_dim=60,
 
 
 def analysis_compressed(wav_file, fft_len=None, mag_dim=60, phase_dim=10,
-                                            b_const_rate=False, b_mag_fbank_mel=False, alpha_phase=None):
+                                            b_const_rate=False, b_mag_fbank_mel=False, alpha_phase=None, epoch_detector=None):
     '''
     Analyses a wavefile and extract compressed features for acoustic modelling.
 
@@ -2956,27 +3510,27 @@ def analysis_compressed(wav_file, fft_len=None, mag_dim=60, phase_dim=10,
     phase_dim:    Number of coefficents (bins) for the phase features (real and imag).
     b_const_rate: If False, output given in variable-frame rate fashion (pitch synchronous) [Default]
                   If True, output given in 5ms constant frame rate shift.
+    epoch_detector: 'reaper', 'native', or None (default set in config.ini).
 
     b_mag_fbank_mel, alpha_phase: Experimental.
     '''
 
     # Analysis lossless:
-    m_mag, m_real, m_imag, v_f0, fs, v_shift = analysis_lossless(wav_file, fft_len=fft_len)
+    m_mag, m_real, m_imag, v_f0, fs, v_shift = analysis_lossless(wav_file, fft_len=fft_len, epoch_detector=epoch_detector)
 
     # To constant rate:
     if b_const_rate:
         const_rate_ms = 5.0
         interp_type = 'linear' #  'quadratic' # 'linear'
         v_pm_smpls = la.shift_to_pm(v_shift)
-        m_mag  = interp_from_variable_to_const_frm_rate(m_mag,  v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_real = interp_from_variable_to_const_frm_rate(m_real, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_imag = interp_from_variable_to_const_frm_rate(m_imag, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
+        rs_plan = plan_var_to_const_frm_rate(v_pm_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag = rs_plan.apply(m_mag, m_real, m_imag)
 
         # f0:
         v_voi = v_f0>1.0
         v_f0  = interp_from_variable_to_const_frm_rate(np.r_[ v_f0[v_voi][0],v_f0[v_voi], v_f0[v_voi][-1] ],
                            np.r_[ 0, v_pm_smpls[v_voi], v_pm_smpls[-1] ], const_rate_ms, fs, interp_type=interp_type).squeeze()
-        v_voi = interp_from_variable_to_const_frm_rate(v_voi, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)>0.5
+        v_voi = rs_plan.apply(v_voi) > 0.5
         v_f0  *= v_voi # Double check this. At the beginning of voiced segments.
 
     # Formatting for Acoustic Modelling:
@@ -2990,28 +3544,35 @@ def analysis_compressed(wav_file, fft_len=None, mag_dim=60, phase_dim=10,
 
 
 def analysis_for_acoustic_modelling(wav_file, out_dir, fft_len=None, mag_dim=60, phase_dim=10,
-                                            b_const_rate=False, b_mag_fbank_mel=False, alpha_phase=None):
+                                            b_const_rate=False, b_mag_fbank_mel=False, alpha_phase=None, epoch_detector=None):
     '''
     Analyses a wavefile and extract compressed features for acoustic modelling.
 
     Params:
     wav_file:     Waveform to be analysed.
     fft_len:      FFT length. If None, its value is set according to the sample rate.
-    out_dir:      Directory where MagPhase features will be stored.
+    out_dir:      Directory where MagPhase features will be stored, or a feature store (lu.FeatStore opened in 'w' or 'a' mode).
     mag_dim:      Number of coefficents (bins) for the Log Magnitude feature (mag).
     phase_dim:    Number of coefficents (bins) for the phase features (real and imag).
     b_const_rate: If False, output given in variable-frame rate fashion (pitch synchronous) [Default]
                   If True, output given in 5ms constant frame rate shift.
+    epoch_detector: 'reaper', 'native', or None (default set in config.ini).
 
     b_mag_fbank_mel, alpha_phase: Experimental.
     '''
 
     m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0_smth, v_shift, fs, fft_len = analysis_compressed(wav_file, fft_len=fft_len, mag_dim=mag_dim, phase_dim=phase_dim,
-                                                                                        b_const_rate=b_const_rate, b_mag_fbank_mel=b_mag_fbank_mel, alpha_phase=b_mag_fbank_mel)
+                                                                                        b_const_rate=b_const_rate, b_mag_fbank_mel=b_mag_fbank_mel, alpha_phase=b_mag_fbank_mel,
+                                                                                        epoch_detector=epoch_detector)
 
 
     # Save features:
     file_id = os.path.basename(wav_file).split(".")[0]
+    if isinstance(out_dir, lu.FeatStore):
+        write_feats_to_store(out_dir, file_id, m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0_smth, fs, fft_len,
+                                                                v_shift=None if b_const_rate else v_shift)
+        return
+
     write_featfile(m_mag_mel_log, out_dir, file_id + '.mag')
     write_featfile(m_real_mel   , out_dir, file_id + '.real')
     write_featfile(m_imag_mel   , out_dir, file_id + '.imag')
@@ -3041,14 +3602,13 @@ def analysis_compressed_type1_with_phase_comp(wav_file, fft_len=None, out_dir=No
         const_rate_ms = 5.0
         interp_type = 'linear' #  'quadratic' # 'linear'
         v_pm_smpls = la.shift_to_pm(v_shift)
-        m_mag  = interp_from_variable_to_const_frm_rate(m_mag,  v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_real = interp_from_variable_to_const_frm_rate(m_real, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
-        m_imag = interp_from_variable_to_const_frm_rate(m_imag, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)
+        rs_plan = plan_var_to_const_frm_rate(v_pm_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag = rs_plan.apply(m_mag, m_real, m_imag)
 
         # f0:
         v_voi = v_f0>1.0
         v_f0  = interp_from_variable_to_const_frm_rate(np.r_[ v_f0[v_voi][0],v_f0[v_voi], v_f0[v_voi][-1] ], np.r_[ 0, v_pm_smpls[v_voi], v_pm_smpls[-1] ], const_rate_ms, fs, interp_type=interp_type).squeeze()
-        v_voi = interp_from_variable_to_const_frm_rate(v_voi, v_pm_smpls, const_rate_ms, fs, interp_type=interp_type)>0.5
+        v_voi = rs_plan.apply(v_voi) > 0.5
         v_f0  *= v_voi # Double check this. At the beginning of voiced segments.
 
     # Debug:-----------------
@@ -3128,16 +3688,13 @@ def analysis_compressed_type2(wav_file, fft_len=None, out_dir=None, mag_dim=60,
     # To constant rate:
     if const_rate_ms>0.0:
         v_pm_smpls = la.shift_to_pm(v_shift)
-        m_mag  = interp_from_variable_to_const_frm_rate(m_mag,  v_pm_smpls, const_rate_ms, fs, interp_type='linear')
-        m_real = interp_from_variable_to_const_frm_rate(m_real, v_pm_smpls, const_rate_ms, fs, interp_type='linear')
-        m_imag = interp_from_variable_to_const_frm_rate(m_imag, v_pm_smpls, const_rate_ms, fs, interp_type='linear')
-        #g = interp_from_variable_to_const_frm_rate(v_gain, v_pm_smpls, const_rate_ms, fs, interp_type='linear')
-        v_gain = interp_from_variable_to_const_frm_rate(v_gain, v_pm_smpls, const_rate_ms, fs, interp_type='linear')
+        rs_plan = plan_var_to_const_frm_rate(v_pm_smpls, const_rate_ms, fs) # (linear interp.)
+        m_mag, m_real, m_imag, v_gain = rs_plan.apply(m_mag, m_real, m_imag, v_gain)
 
         # f0:
         v_voi = v_f0>1.0
         v_f0  = interp_from_variable_to_const_frm_rate(np.r_[ v_f0[v_voi][0],v_f0[v_voi], v_f0[v_voi][-1] ], np.r_[ 0, v_pm_smpls[v_voi], v_pm_smpls[-1] ], const_rate_ms, fs, interp_type='linear').squeeze()
-        v_voi = interp_from_variable_to_const_frm_rate(v_voi, v_pm_smpls, const_rate_ms, fs, interp_type='linear')>0.5
+        v_voi = rs_plan.apply(v_voi) > 0.5
         v_f0  *= v_voi # Double check this. At the beginning of voiced segments.
 
 
@@ -3227,12 +3784,13 @@ def synthesis_from_acoustic_modelling_old(in_feats_dir, filename_token, out_syn_
     return
 
 def synthesis_from_acoustic_modelling(in_feats_dir, filename_token, out_syn_dir, mag_dim, phase_dim, fs,
-                                            fft_len=None, pf_type='no', b_const_rate=False):
+                                            fft_len=None, pf_type='no', b_const_rate=False, dtype='float64'):
     '''
     Synthesises a waveform from compressed MagPhase features.
 
     Params:
     in_feats_dir:   Directory containing the MagPhase features .mag, .real, .imag, and .lf0
+                    or a feature store (lu.FeatStore) containing them.
     filename_token: Name of the utterace. E.g., "arctic_a0001"
     out_syn_dir:    Directory where the synthesised waveform will be stored.
     mag_dim:        Number of coefficents (bins) for the Log Magnitude feature (mag).
@@ -3245,16 +3803,76 @@ def synthesis_from_acoustic_modelling(in_feats_dir, filename_token, out_syn_dir,
                     "no":      No postfilter.
     b_const_rate:   If False, variable-frame rate input features (pitch synchronous) [Default]
                     If True,   5ms constant frame rate input features.
+    dtype:          'float64' [Default], or 'float32': Features are memory-mapped, and postfilter and synthesis are
+                    computed in single precision (half the memory bandwidth. See synthesis_from_compressed).
     '''
 
     # Display:
     print("\nSynthesising file: " + filename_token + '.wav............................')
 
+    m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0 = read_feats_for_synthesis(in_feats_dir, filename_token, mag_dim, phase_dim, fs,
+                                                                            pf_type=pf_type, b_const_rate=b_const_rate, dtype=dtype)
+
+    # Waveform generation:
+    v_syn_sig = synthesis_from_compressed(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0,
+                                                fs, fft_len=fft_len, b_const_rate=b_const_rate, dtype=dtype)
+
+    la.write_audio_file(out_syn_dir + '/' + filename_token + '.wav', v_syn_sig, fs)
+    return
+
+
+
+def synthesis_from_acoustic_modelling_batch(in_feats_dir, l_filename_tokens, out_syn_dir, mag_dim, phase_dim, fs,
+                                            fft_len=None, pf_type='no', b_const_rate=False, dtype='float64', max_nfrms=500):
+    '''
+    Synthesises several waveforms from compressed MagPhase features, processing the frames of several utterances together
+    (see synthesis_from_compressed_batch). Faster than calling synthesis_from_acoustic_modelling per file for short utterances.
+    l_filename_tokens: List of utterance names. E.g., ["arctic_a0001", "arctic_a0002"]
+    max_nfrms:         Maximum number of input frames per batch (approx.). The utterances are grouped in order, and an
+                       utterance longer than max_nfrms is synthesised alone. Synthesis is mostly memory bound (full
+                       resolution spectra), so larger batches do not run faster, they just use more memory.
+    Other params: see synthesis_from_acoustic_modelling.
+    Returns the number of synthesised frames.
+    '''
+    nfrms_total = 0
+    l_batch = []
+    nfrms_batch = 0
+    for nx_tokn, filename_token in enumerate(l_filename_tokens):
+        feats = read_feats_for_synthesis(in_feats_dir, filename_token, mag_dim, phase_dim, fs, pf_type=pf_type, b_const_rate=b_const_rate, dtype=dtype)
+        l_batch.append((filename_token, feats))
+        nfrms_batch += np.size(feats[0], 0)
+
+        if (nfrms_batch < max_nfrms) and (nx_tokn < (len(l_filename_tokens) - 1)):
+            continue
+
+        print("\nSynthesising %d file(s) (%d frames): %s" % (len(l_batch), nfrms_batch, ', '.join([ tokn for tokn, feats in l_batch ])))
+        l_syn_sig = synthesis_from_compressed_batch([ feats for tokn, feats in l_batch ], fs, fft_len=fft_len, b_const_rate=b_const_rate, dtype=dtype)
+        for (tokn, feats), v_syn_sig in zip(l_batch, l_syn_sig):
+            la.write_audio_file(out_syn_dir + '/' + tokn + '.wav', v_syn_sig, fs)
+
+        nfrms_total += nfrms_batch
+        l_batch = []
+        nfrms_batch = 0
+
+    return nfrms_total
+
+def read_feats_for_synthesis(in_feats_dir, filename_token, mag_dim, phase_dim, fs, pf_type='no', b_const_rate=False, dtype='float64'):
+    '''
+    Reads the compressed MagPhase features of an utterance and applies the postfilter.
+    Used by synthesis_from_acoustic_modelling and synthesis_from_acoustic_modelling_batch (see their params).
+    Returns m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0.
+    '''
     # Reading parameter files:
-    m_mag_mel_log = lu.read_binfile(in_feats_dir + '/' + filename_token + '.mag' , dim=mag_dim)
-    m_real_mel    = lu.read_binfile(in_feats_dir + '/' + filename_token + '.real', dim=phase_dim)
-    m_imag_mel    = lu.read_binfile(in_feats_dir + '/' + filename_token + '.imag', dim=phase_dim)
-    v_lf0         = lu.read_binfile(in_feats_dir + '/' + filename_token + '.lf0' , dim=1)
+    if isinstance(in_feats_dir, lu.FeatStore):
+        m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, d_attrs = read_feats_from_store(in_feats_dir, filename_token, dtype=dtype)
+        if (d_attrs['mag_dim'], d_attrs['phase_dim'], d_attrs['fs'], d_attrs['b_const_rate']) != (mag_dim, phase_dim, fs, b_const_rate):
+            raise ValueError('Features of %s in the feature store not compatible with mag_dim, phase_dim, fs, or b_const_rate provided.' % filename_token)
+    else:
+        b_mmap = np.dtype(dtype)==np.float32
+        m_mag_mel_log = lu.read_binfile(in_feats_dir + '/' + filename_token + '.mag' , dim=mag_dim,   dtype=dtype, b_mmap=b_mmap)
+        m_real_mel    = lu.read_binfile(in_feats_dir + '/' + filename_token + '.real', dim=phase_dim, dtype=dtype, b_mmap=b_mmap)
+        m_imag_mel    = lu.read_binfile(in_feats_dir + '/' + filename_token + '.imag', dim=phase_dim, dtype=dtype, b_mmap=b_mmap)
+        v_lf0         = lu.read_binfile(in_feats_dir + '/' + filename_token + '.lf0' , dim=1,         dtype=dtype, b_mmap=b_mmap)
 
     if pf_type=='magphase':
         print('Using MagPhase postfilter...')
@@ -3267,13 +3885,7 @@ def synthesis_from_acoustic_modelling(in_feats_dir, filename_token, out_syn_dir,
     elif pf_type=='no':
         print('No postfilter...')
 
-    # Waveform generation:
-    v_syn_sig = synthesis_from_compressed(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0,
-                                                fs, fft_len=fft_len, b_const_rate=b_const_rate)
-
-    la.write_audio_file(out_syn_dir + '/' + filename_token + '.wav', v_syn_sig, fs)
-    return
-
+    return m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0
 
 
 def define_alpha(fs):
@@ -3298,6 +3910,22 @@ def define_fft_len(fs):
         fft_len = 4096
     return fft_len
 
+def warm_up(fs, mag_dim=60, phase_dim=45, fft_len=None):
+    '''
+    Precomputes the transformation matrices used by format_for_modelling and synthesis_from_compressed, so they are
+    stored in the transform cache (see la.transform_cache_info), and the synthesis plan (see get_synthesis_plan).
+    E.g., to be called once per worker process in batch processing (see init_func in lu.run_batch).
+    '''
+    if fft_len is None:
+        fft_len = define_fft_len(fs)
+
+    get_synthesis_plan(fs, fft_len)
+
+    m_ones = np.ones((2, fft_len / 2 + 1))
+    m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0 = format_for_modelling(m_ones, m_ones, m_ones, 100.0 * np.ones(2), fs, mag_dim=mag_dim, phase_dim=phase_dim)
+    uncompress_feats(m_mag_mel_log, m_real_mel, m_imag_mel, v_lf0, fs, fft_len)
+    return
+
 def define_crossfade_params(fs):
     crsf_bw = 2000
     if fs==48000:
@@ -3317,10 +3945,22 @@ def define_crossfade_params(fs):
     return crsf_cf, crsf_bw
 
 
-def griffin_lim(m_mag, v_shift, win_func=np.hanning, phase_init='random', niters=30):
+def griffin_lim(m_mag, v_shift, win_func=np.hanning, phase_init='random', niters=30, momentum=0.5, tol=1e-3,
+                                                                                    b_verbose=False, b_ret_info=False):
     '''
-    Pitch synchronous Griffin-Lim algorithm.
+    Pitch synchronous (fast) Griffin-Lim algorithm.
     phase_init: 'random' (random phase), 'linear' (linear phase), 'min_phase' (minimum phase), or numpy 2D array (matrix) containing initial phase values.
+    niters:     Maximum number of iterations.
+    momentum:   Fast Griffin-Lim (Perraudin et al., 2013) acceleration. If 0.0, classic Griffin-Lim.
+                NOTE: The usual 0.99 does not work well here, since pitch synchronous OLA (without synthesis window)
+                is not an exact projection. Values around 0.3-0.6 work better.
+    tol:        Early stopping. The spectral convergence (inconsistency between m_mag and the magnitude of the
+                synthesised signal) is measured every iteration. It stops when its best value improves less than tol
+                (relative) per iteration, on average over the last 5 iterations. If None, it runs niters iterations.
+    b_verbose:  If True, it prints the spectral convergence and time per iteration.
+    b_ret_info: If True, it also returns a dictionary with the spectral convergence and time per iteration.
+
+    Framing (analysis) and overlap-add (synthesis) indexes and windows are computed once and reused by all the iterations.
     '''
 
     print('Starting Griffin-Lim. It could take a while...')
@@ -3329,137 +3969,133 @@ def griffin_lim(m_mag, v_shift, win_func=np.hanning, phase_init='random', niters
     nfrms, fft_len_half = m_mag.shape
     fft_len = 2 * (fft_len_half - 1)
 
-    # Initial phase set up:
+    # Initial phase set up (non-redundant half. Phase at the first and last bins set to zero, as in la.add_hermitian_half):
     if type(phase_init)==str:
 
         if phase_init=='random':
-            m_phase = 2 * np.pi * (np.random.rand(nfrms, fft_len) - 0.5)
+            m_phase = 2 * np.pi * (np.random.rand(nfrms, fft_len_half) - 0.5)
+            m_phase[:,[0,-1]] = 0.0
 
         elif phase_init=='linear':
             m_frms_zero = np.zeros((nfrms, fft_len))
             m_frms_zero[:,(fft_len/2)] = 1.0
-            m_phase = np.angle(np.fft.fft(m_frms_zero))
+            m_phase = np.angle(la.rfft_frames(m_frms_zero))
 
         elif phase_init=='min_phase':
             m_mag_cmplx_min_ph = la.build_min_phase_from_mag_spec(m_mag)
             m_phase = np.angle(m_mag_cmplx_min_ph)
-            m_phase = la.add_hermitian_half(m_phase, data_type='phase')
+            m_phase[:,[0,-1]] = 0.0
 
     elif type(phase_init)==np.ndarray:
-        m_phase = la.add_hermitian_half(phase_init, data_type='phase')
-
-    # protection for indexes 0 and fft_len_half?
-
-    m_mag = la.add_hermitian_half(m_mag)
-    v_pm = la.shift_to_pm(v_shift)
+        m_phase = phase_init.copy()
+        m_phase[:,[0,-1]] = 0.0
+
+    m_phasor = np.exp(m_phase * 1j) # unit phasors (it avoids computing angles and complex exponentials every iteration)
+
+    # Synthesis plan (as ola, without window):
+    v_pm     = la.shift_to_pm(v_shift)
+    v_sh_ola = la.pm_to_shift(v_pm)
+    v_strt   = np.hstack((0, np.cumsum(v_sh_ola[1:nfrms])))
+    nx_strt  = fft_len/2 - v_pm[0]
+    sig_len  = v_pm[-1] + v_sh_ola[-1] + 1
+
+    # Analysis plan (as windowing + la.frm_list_to_matrix, i.e., frames centred at fft_len/2):
+    v_nx_sig, v_nx_row, v_nx_col, v_win = windowing_plan(sig_len, v_pm, fft_len, win_func=win_func)[:4]
+    v_nx_flat  = v_nx_row * fft_len + (v_nx_col + fft_len/2) % fft_len
+    m_frms_ana = np.zeros((nfrms, fft_len))
+    v_frms_ana = m_frms_ana.reshape(-1) # view
+    v_data     = np.zeros(len(v_nx_sig)) # buffer
+
+    nchk     = 5 # number of iterations to check convergence
+    mag_norm = np.linalg.norm(m_mag)
+    l_spec_conv = []
+    l_best      = []
+    l_time      = []
+    m_cmplx_sp_prev = None
     for nxi in xrange(niters):
+        t_strt = time.time()
 
         # Synthesis:
-        m_cmplx_sp = m_mag * np.exp(m_phase * 1j)
-        m_frms     = np.fft.ifft(m_cmplx_sp).real
-        v_sig = ola(m_frms, v_pm, win_func=None)
+        m_frms = la.irfft_frames(m_mag * m_phasor, fft_len)
+        v_sig  = la.ola_var_shift(m_frms, v_strt, sig_len=(v_pm[-1] + fft_len))[nx_strt:(nx_strt+sig_len)]
+
+        # Analysis:
+        if win_func is None:
+            v_frms_ana[v_nx_flat] = v_sig[v_nx_sig]
+        else:
+            np.multiply(v_sig[v_nx_sig], v_win, out=v_data)
+            v_frms_ana[v_nx_flat] = v_data
+        m_cmplx_sp = la.rfft_frames(m_frms_ana, fft_len)
+
+        # Convergence:
+        m_cmplx_sp_mag = np.absolute(m_cmplx_sp)
+        l_spec_conv.append(np.linalg.norm(m_cmplx_sp_mag - m_mag) / mag_norm)
+        l_best.append(min(l_spec_conv))
+        b_converged = (tol is not None) and (nxi >= nchk) and ((l_best[-nchk-1] - l_best[-1]) < (tol * nchk * l_best[-nchk-1]))
 
-        if nxi==(niters-1):
+        if b_verbose:
+            print('Griffin-Lim iteration %d: spectral convergence: %.5f (%.3f s)' % (nxi+1, l_spec_conv[-1], time.time() - t_strt))
+
+        if b_converged or (nxi==(niters-1)):
+            l_time.append(time.time() - t_strt)
             break
 
-        # Analysis:
-        l_frms, v_lens, v_pm_plus, v_shift_dummy, v_rights = windowing(v_sig, v_pm, win_func=win_func)
-        m_frms = la.frm_list_to_matrix(l_frms, v_shift, fft_len)
-        m_cmplx_sp = np.fft.fft(m_frms, n=fft_len)
+        # Update (with momentum):
+        if (momentum > 0.0) and (m_cmplx_sp_prev is not None):
+            m_cmplx_sp_mom = m_cmplx_sp + momentum * (m_cmplx_sp - m_cmplx_sp_prev)
+            m_cmplx_sp_mag = np.absolute(m_cmplx_sp_mom)
+        else:
+            m_cmplx_sp_mom = m_cmplx_sp
 
-        # Update:
-        m_phase = np.angle(m_cmplx_sp)
+        m_cmplx_sp_mag[m_cmplx_sp_mag==0.0] = 1.0 # protection
+        m_phasor = m_cmplx_sp_mom / m_cmplx_sp_mag
+        m_cmplx_sp_prev = m_cmplx_sp
+        l_time.append(time.time() - t_strt)
 
-    return v_sig, la.remove_hermitian_half(m_phase)
+    m_phase = np.angle(m_phasor)
+    if b_ret_info:
+        d_info = {'spec_conv': l_spec_conv, 'time': l_time, 'niters': len(l_time), 'b_converged': b_converged}
+        return v_sig, m_phase, d_info
 
-def post_filter_merlin(m_mag_mel_log, fs, pf_coef=1.4):
+    return v_sig, m_phase
 
+def post_filter_merlin(m_mag_mel_log, fs, pf_coef=1.4):
     '''
+    Merlin's style postfilter: Frequency-warped cepstral liftering (coefficients from the second onwards are multiplied
+    by pf_coef), with energy preservation. It computes the same as Merlin's pipeline of SPTK commands (freqt, c2acr,
+    vopr, mc2b, bcp, sopr, merge, b2mc), but in-process and for all frames at once.
     TODO: Add note about Merlin copyright
     '''
 
     # Constants:
-    fft_len   = 4096
-    minph_ord = fft_len / 2 - 1  # minimum phase order (2047)
-    alpha = define_alpha(fs)
-
-    # Temp files setup:
-    temp_mcep    = lu.ins_pid('temp.mcep')
-    temp_mcep_pf = lu.ins_pid('temp.mcep_pf')
-    temp_lifter  = lu.ins_pid('temp.lift')
-    temp_r0      = lu.ins_pid('temp.r0')
-    temp_p_r0    = lu.ins_pid('temp.p_r0')
-    temp_b0      = lu.ins_pid('temp.b0')
-    temp_p_b0    = lu.ins_pid('temp.p_b0')
+    fft_len = 4096
+    alpha   = define_alpha(fs)
+    ncoeffs = m_mag_mel_log.shape[1]
 
+    # Mel-cepstrum and liftering:
+    m_mcep    = la.rceps(m_mag_mel_log, in_type='log', out_type='compact')
+    v_lifter  = np.r_[1.0, 1.0, pf_coef * np.ones(ncoeffs-2)]
+    m_mcep_pf = m_mcep * v_lifter
 
-    # Save m_mag_mel_log into mcep:
-    m_mcep = la.rceps(m_mag_mel_log, in_type='log', out_type='compact')
-    lu.write_binfile(m_mcep, temp_mcep)
+    # Energy (autocorrelation at lag 0, r0) of the spectrum at linear frequency (SPTK: freqt -A 0 | c2acr -M 0):
+    # Mean of the power spectrum over the fft_len bins of the unit circle. The log spectrum is directly evaluated
+    # at those bins from the mel-cepstrum (cosine matrix), instead of converting to a 2047th order linear cepstrum.
+    m_trans   = la.get_cosmat(ncoeffs, fft_len/2 + 1, alpha)
+    v_weights = np.r_[1.0, 2.0 * np.ones(fft_len/2 - 1), 1.0] / fft_len # non-redundant half
 
-    ncoeffs = m_mag_mel_log.shape[1]
+    def log_r0(m_mcep):
+        m_pow_log = 2.0 * np.dot(m_mcep, m_trans)
+        v_max     = np.max(m_pow_log, axis=1) # protection against overflow
+        return v_max + np.log(np.dot(np.exp(m_pow_log - v_max[:,None]), v_weights))
 
-    # Building lifter:
-    lifter = "echo 1 1 " + ("%1.2f " % pf_coef) * (ncoeffs-2)
-
-    # SPTK binaries:
-    x2x_bin   = os.path.join(la._sptk_dir, 'x2x')
-    freqt_bin = os.path.join(la._sptk_dir, 'freqt')
-    c2acr_bin = os.path.join(la._sptk_dir, 'c2acr')
-    vopr_bin  = os.path.join(la._sptk_dir, 'vopr')
-    mc2b_bin  = os.path.join(la._sptk_dir, 'mc2b')
-    bcp_bin   = os.path.join(la._sptk_dir, 'bcp')
-    sopr_bin  = os.path.join(la._sptk_dir, 'sopr')
-    merge_bin = os.path.join(la._sptk_dir, 'merge')
-    b2mc_bin  = os.path.join(la._sptk_dir, 'b2mc')
-
-    # Saving lifter in file:
-    curr_cmd = '{lifter} | {x2x} +af > {weight}'.format(lifter=lifter, x2x=x2x_bin, weight=temp_lifter)
-    call(curr_cmd, shell=True)
-    #--------------------------------------
-    # Saving Base r0:
-    curr_cmd = '{freqt} -m {order} -a {fw} -M {co} -A 0 < {mgc} | {c2acr} -m {co} -M 0 -l {fl} > {base_r0}'.\
-                    format(freqt=freqt_bin, order=ncoeffs-1, fw=alpha, co=minph_ord, mgc=temp_mcep, c2acr=c2acr_bin, fl=fft_len, base_r0=temp_r0)
-    call(curr_cmd, shell=True)
-    #--------------------------------------
-    curr_cmd = '{vopr} -m -n {order} < {mgc} {weight} | {freqt} -m {order} -a {fw} -M {co} -A 0 | {c2acr} -m {co} -M 0 -l {fl} > {base_p_r0}'\
-                                .format(vopr=vopr_bin, order=ncoeffs-1, mgc=temp_mcep, weight=temp_lifter, freqt=freqt_bin, fw=alpha, co=minph_ord,
-                                                                                                    c2acr=c2acr_bin, fl=fft_len, base_p_r0=temp_p_r0)
-    call(curr_cmd, shell=True)
-
-    #--------------------------------------
-    curr_cmd = '{vopr} -m -n {order} < {mgc} {weight} | {mc2b} -m {order} -a {fw} | {bcp} -n {order} -s 0 -e 0 > {base_b0}'\
-                    .format(vopr=vopr_bin, order=ncoeffs-1, mgc=temp_mcep, weight=temp_lifter, mc2b=mc2b_bin, fw=alpha, bcp=bcp_bin, base_b0=temp_b0)
-    call(curr_cmd, shell=True)
-
-    #--------------------------------------
-    curr_cmd = '{vopr} -d < {base_r0} {base_p_r0} | {sopr} -LN -d 2 | {vopr} -a {base_b0} > {base_p_b0}'\
-                .format(vopr=vopr_bin, base_r0=temp_r0, base_p_r0=temp_p_r0, sopr=sopr_bin, base_b0=temp_b0, base_p_b0=temp_p_b0)
-    call(curr_cmd, shell=True)
-    #--------------------------------------
-
-    curr_cmd = '{vopr} -m -n {order} < {mgc} {weight} | {mc2b} -m {order} -a {fw} | {bcp} -n {order} -s 1 -e {order} | {merge} -n {order2} -s 0 -N 0 {base_p_b0} | {b2mc} -m {order} -a {fw} > {base_p_mgc}'\
-                            .format(vopr=vopr_bin, order=ncoeffs-1, mgc=temp_mcep, weight=temp_lifter, mc2b=mc2b_bin, fw=alpha, bcp=bcp_bin,
-                                                    merge=merge_bin, order2=ncoeffs-2, base_p_b0=temp_p_b0, b2mc=b2mc_bin, base_p_mgc=temp_mcep_pf)
-    call(curr_cmd, shell=True)
-
-    #--------------------------------------
+    # Energy preservation (SPTK: mc2b, b(0) += 0.5*log(r0/r0_pf), b2mc).
+    # Since b2mc(mc2b(mcep)) = mcep, only the first coefficient changes:
+    m_mcep_pf[:,0] += 0.5 * (log_r0(m_mcep) - log_r0(m_mcep_pf))
 
     # Convert to mel_mag_log:
-    m_mcep_pf = lu.read_binfile(temp_mcep_pf, dim=ncoeffs)
     m_mag_mel_log_pf = la.mcep_to_sp_cosmat(m_mcep_pf, ncoeffs, alpha=0.0, out_type='log')
 
     # Protection agains possible nans:
     m_mag_mel_log_pf[np.isnan(m_mag_mel_log_pf)] = la.MAGIC
 
-    # Temp files removal:
-    os.remove(temp_mcep)
-    os.remove(temp_mcep_pf)
-    os.remove(temp_lifter)
-    os.remove(temp_r0)
-    os.remove(temp_p_r0)
-    os.remove(temp_b0)
-    os.remove(temp_p_b0)
-
-
     return m_mag_mel_log_pf
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Tests of the native epoch detector (la.epoch_detection) against REAPER.
+
+data/reaper_hvd_592.est was generated by REAPER from demos/data_48k/wavs_nat/hvd_592.wav, with the flags used by
+la.reaper (-s -x 400 -m 50 -a -u 0.005 -p).
+
+Run: python -m unittest discover tests
+"""
+import sys, os
+import unittest
+this_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(this_dir + '/../src'))
+
+import numpy as np
+import soundfile as sf
+from scipy import signal
+import libaudio as la
+
+wav_file = os.path.realpath(os.path.join(this_dir, '..', 'demos', 'data_48k', 'wavs_nat', 'hvd_592.wav'))
+est_file = os.path.join(this_dir, 'data', 'reaper_hvd_592.est')
+
+def voicing_at(v_pm_sec, v_voi, v_t_sec):
+    '''
+    Voicing of the nearest epoch to each time in v_t_sec.
+    '''
+    v_nx = np.clip(np.searchsorted(v_pm_sec, v_t_sec), 1, v_pm_sec.size-1)
+    v_nx = np.where(np.abs(v_pm_sec[v_nx-1] - v_t_sec) < np.abs(v_pm_sec[v_nx] - v_t_sec), v_nx-1, v_nx)
+    return v_voi[v_nx]
+
+def nearest_diff(v_ref_sec, v_test_sec):
+    '''
+    Difference between each time in v_ref_sec and the nearest one in v_test_sec (test - ref).
+    '''
+    v_nx = np.clip(np.searchsorted(v_test_sec, v_ref_sec), 1, v_test_sec.size-1)
+    v_diff_l = v_test_sec[v_nx-1] - v_ref_sec
+    v_diff_r = v_test_sec[v_nx]   - v_ref_sec
+    return np.where(np.abs(v_diff_l) < np.abs(v_diff_r), v_diff_l, v_diff_r)
+
+class TestEpochDetection(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        v_sig, cls.fs = sf.read(wav_file)
+        cls.dur_sec   = v_sig.size / float(cls.fs)
+        cls.v_pm_ref, cls.v_voi_ref = la.read_reaper_est_file(est_file, b_cache=False)
+        cls.v_pm, cls.v_voi = la.epoch_detection(v_sig, cls.fs)
+
+    def test_voicing_agreement(self):
+        v_t_sec = np.arange(0.0, self.dur_sec, 0.005)
+        v_agree = voicing_at(self.v_pm, self.v_voi, v_t_sec) == voicing_at(self.v_pm_ref, self.v_voi_ref, v_t_sec)
+        self.assertGreater(np.mean(v_agree), 0.90)
+
+    def test_voiced_epochs_agreement(self):
+        # REAPER GCIs where the native detector is voiced too:
+        v_gci_ref = self.v_pm_ref[self.v_voi_ref==1]
+        v_gci_ref = v_gci_ref[voicing_at(self.v_pm, self.v_voi, v_gci_ref)==1]
+        v_diff_ms = 1000.0 * nearest_diff(v_gci_ref, self.v_pm[self.v_voi==1])
+
+        self.assertGreater(v_gci_ref.size, 100)
+        self.assertLess(np.abs(np.median(v_diff_ms)), 0.1) # no systematic offset
+        self.assertGreater(np.mean(np.abs(v_diff_ms) <= 0.5), 0.8)
+
+    def test_epochs_sorted_and_within_signal(self):
+        self.assertEqual(self.v_pm.size, self.v_voi.size)
+        self.assertTrue(np.all(np.diff(self.v_pm) > 0.0))
+        self.assertTrue((self.v_pm[0] >= 0.0) and (self.v_pm[-1] < self.dur_sec))
+
+    def test_refine_epochs_to_excitation(self):
+        # Pulse train through an all-pole filter (one formant). The excitation pulses are the GCIs:
+        fs     = 16000
+        period = 123
+        v_gci  = np.arange(200, fs - 200, period)
+        v_exc  = np.zeros(fs)
+        v_exc[v_gci] = -1.0
+        v_sig  = signal.lfilter([1.0], np.poly([0.97 * np.exp(2j * np.pi * 700.0 / fs), 0.97 * np.exp(-2j * np.pi * 700.0 / fs)]).real, v_exc)
+
+        v_ep_early = v_gci - int(0.3 * period) # leading epochs, as from ZFF
+        v_ep = la.refine_epochs(v_ep_early, la.lp_residual(v_sig, fs), period + np.zeros(v_gci.size))
+        self.assertTrue(np.array_equal(v_ep, v_gci))
+
+if __name__ == '__main__':
+    unittest.main()
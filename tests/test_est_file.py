@@ -0,0 +1,102 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Tests of the EST file parser (la.parse_est_file) against real REAPER output.
+
+data/reaper_ascii.est and data/reaper_binary.est were generated by REAPER from the same excerpt of a speech file, with
+the flags used by la.reaper (-s -x 400 -m 50 -u 0.005 -p), with and without -a (ASCII and binary2 data types, respectively).
+
+Run: python -m unittest discover tests
+"""
+import sys, os
+import unittest
+import tempfile
+this_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(this_dir + '/../src'))
+
+import numpy as np
+import libaudio as la
+
+ascii_file  = os.path.join(this_dir, 'data', 'reaper_ascii.est')
+binary_file = os.path.join(this_dir, 'data', 'reaper_binary.est')
+
+class TestParseEstFile(unittest.TestCase):
+
+    def setUp(self):
+        self.l_temp_files = []
+        return
+
+    def tearDown(self):
+        for temp_file in self.l_temp_files:
+            os.remove(temp_file)
+        return
+
+    def write_temp_file(self, data):
+        fd, temp_file = tempfile.mkstemp(suffix='.est')
+        os.write(fd, data)
+        os.close(fd)
+        self.l_temp_files.append(temp_file)
+        return temp_file
+
+    def split_header(self, est_file):
+        with open(est_file, 'rb') as fid:
+            data = fid.read()
+        nx_end = data.find('EST_Header_End\n') + len('EST_Header_End\n')
+        return data[:nx_end], data[nx_end:]
+
+    def test_binary2_matches_ascii(self):
+        m_ascii, d_header_ascii = la.parse_est_file(ascii_file)
+        m_bin,   d_header_bin   = la.parse_est_file(binary_file)
+
+        self.assertEqual(d_header_bin['DataType'], 'binary2')
+        self.assertEqual(m_bin.shape, (int(d_header_bin['NumFrames']), 2 + int(d_header_bin['NumChannels'])))
+        self.assertEqual(m_bin.shape, m_ascii.shape)
+        self.assertTrue(np.array_equal(m_bin[:,1], m_ascii[:,1])) # voicing
+        self.assertTrue(np.any(m_bin[:,1]==1) and np.any(m_bin[:,1]==0))
+        self.assertTrue(np.allclose(m_bin, m_ascii, rtol=0.0, atol=1e-6)) # ASCII is written with 6 decimals
+
+    def test_reaper_epochs_binary2_matches_ascii(self):
+        v_pm_sec_ascii, v_voi_ascii = la.read_reaper_est_file(ascii_file,  b_cache=False)
+        v_pm_sec_bin,   v_voi_bin   = la.read_reaper_est_file(binary_file, b_cache=False)
+
+        self.assertTrue(np.allclose(v_pm_sec_bin, v_pm_sec_ascii, rtol=0.0, atol=1e-6))
+        self.assertTrue(np.array_equal(v_voi_bin, v_voi_ascii))
+
+    def test_binary2_big_endian(self):
+        header, body = self.split_header(binary_file)
+        nfrms = int(la.parse_est_file(binary_file)[1]['NumFrames'])
+
+        # Same data, stored big endian:
+        v_times = np.frombuffer(body, dtype='<f4', count=nfrms).astype('>f4').tostring()
+        v_voi   = body[(4 * nfrms):(5 * nfrms)]
+        v_chans = np.frombuffer(body, dtype='<f4', offset=(5 * nfrms)).astype('>f4').tostring()
+        header  = header.replace('EST_Header_End\n', 'ByteOrder 10\nEST_Header_End\n')
+        temp_file = self.write_temp_file(header + v_times + v_voi + v_chans)
+
+        self.assertTrue(np.array_equal(la.parse_est_file(temp_file)[0], la.parse_est_file(binary_file)[0]))
+
+    def test_binary_interleaved(self):
+        m_ascii = la.parse_est_file(ascii_file)[0]
+        header  = self.split_header(ascii_file)[0].replace('DataType ascii', 'DataType binary')
+        temp_file = self.write_temp_file(header + m_ascii.astype('<f4').tostring())
+
+        self.assertTrue(np.array_equal(la.parse_est_file(temp_file)[0], m_ascii.astype('<f4')))
+
+    def test_unsupported_data_type(self):
+        header, body = self.split_header(binary_file)
+        temp_file = self.write_temp_file(header.replace('DataType binary2', 'DataType binary3') + body)
+
+        with self.assertRaises(ValueError) as context:
+            la.parse_est_file(temp_file)
+        self.assertIn('Unsupported DataType "binary3"', str(context.exception))
+
+    def test_binary2_wrong_size(self):
+        header, body = self.split_header(binary_file)
+        temp_file = self.write_temp_file(header + body[:-1])
+
+        with self.assertRaises(ValueError) as context:
+            la.parse_est_file(temp_file)
+        self.assertIn('Wrong size of binary data', str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main()